@@ -1,22 +1,26 @@
+import io
 import logging
 import shutil
-import tempfile
-import threading
-import time
 from datetime import datetime
-import zipfile
 import os
-from flask import Flask, redirect, url_for, render_template, send_from_directory, request, send_file, jsonify, after_this_request
-from PyPDF2 import PdfReader
+from flask import Flask, redirect, url_for, render_template, send_from_directory, request, send_file, jsonify, Response, \
+    stream_template
 from werkzeug.utils import secure_filename
 from flask_socketio import SocketIO
 
 from src import utils
-from config import UPLOAD_FOLDER, OUTPUT_FOLDER, SECRET_KEY, MISMATCH_FOLDER, MATCH_FOLDER, BASELINE_IMG_FOLDER, CHANGED_IMG_FOLDER, MAX_CONTENT_LENGTH
-from src.notifications import get_notifications, get_all_notifications
-from src.pdf_compare import compare_pdf_folders_in_parallel
-from src.upload import upload_file, process_file
+from config import UPLOAD_FOLDER, OUTPUT_FOLDER, SECRET_KEY, MISMATCH_FOLDER, MATCH_FOLDER, BASELINE_IMG_FOLDER, CHANGED_IMG_FOLDER, MAX_CONTENT_LENGTH, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_TTL, \
+    ZIP_COMPRESSION
+from src.notifications import get_notifications, iter_all_notifications
+from src.pdf_compare import compare_pdf_folders_in_parallel, render_artifact_image, clear_deferred_artifacts, deferred_artifacts, artifact_writer
+from src.upload import upload_file, process_file, enqueue_files, job_workers
+from src.jobs import job_queue
 from src.signature_detection import signature_detector
+from src.cache import detection_cache
+from src.upload_sessions import upload_sessions
+from src.output_index import output_index
+from src.reports import report_cache
+from src.zip_stream import stream_zip, ZIP_COMPRESSION_MODES
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
@@ -43,6 +47,15 @@ if not os.path.exists(TEMP_DIR):
 async def update_progress(progress, message):
     socketio.emit('progress_update', {'progress': progress, 'message': message})
 
+def job_progress(job_id, processed, total):
+    progress = round(processed / total * 100) if total else 100
+    message = f'{processed} of {total} files processed'
+    socketio.emit('progress_update', {'progress': progress, 'message': message, 'job_id': job_id})
+
+job_workers.on_progress = job_progress
+# Pick up jobs a previous run left queued or in progress instead of waiting for the next upload
+job_workers.start()
+
 @app.route('/')
 async def index():
     return redirect(url_for('dashboard'))
@@ -56,42 +69,50 @@ async def compare():
     return render_template('compare.html')
 
 
+def receive_chunk(session_id, folder=None):
+    """Store the request's chunk in its upload session; returns the file's path once the file is complete."""
+    return upload_sessions.receive_chunk(
+        session_id, request.files['chunk'].stream, request.form['fileName'],
+        int(request.form['chunkNumber']), int(request.form['totalChunks']),
+        request.form.get('chunkSize', UPLOAD_CHUNK_SIZE, type=int), request.form.get('totalSize', type=int), folder)
+
+@app.route('/upload_sessions', methods=['POST'])
+async def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    upload_sessions.expire(UPLOAD_SESSION_TTL)
+    session_id = upload_sessions.create(data.get('kind', 'upload'))
+    return jsonify({'status': 'success', 'sessionId': session_id}), 201
+
+@app.route('/upload_sessions/<session_id>')
+async def upload_session_status(session_id):
+    # Lets a client that lost its connection see which chunks were received and resume with the rest
+    manifest = upload_sessions.manifest(session_id)
+    if manifest is None:
+        return jsonify({'status': 'error', 'message': 'Unknown upload session'}), 404
+    return jsonify(manifest)
+
+@app.route('/upload_sessions/<session_id>', methods=['DELETE'])
+async def delete_upload_session(session_id):
+    # Removes the session's files once the client is done with them, leaving other sessions and queued jobs alone
+    if not upload_sessions.exists(session_id):
+        return jsonify({'status': 'error', 'message': 'Unknown upload session'}), 404
+    upload_sessions.delete(session_id)
+    return jsonify({'status': 'success'})
+
 @app.route('/upload_file_chunk', methods=['POST'])
 def upload_file_chunk():
-    chunk = request.files['chunk']
-    file_name = request.form['fileName']
+    session_id = request.form.get('sessionId', '')
     chunk_number = int(request.form['chunkNumber'])
     total_chunks = int(request.form['totalChunks'])
-    upload_folder = app.config['UPLOAD_FOLDER']
-
-    # Generate temporary directory for this upload
-    if 'temp_dir' not in globals():
-        globals()['temp_dir'] = generate_temp_dir('file_upload')
-    temp_dir = globals()['temp_dir']
-
-    # Create the temporary directory if it doesn't exist
-    os.makedirs(temp_dir, exist_ok=True)
+    if not upload_sessions.exists(session_id):
+        return jsonify({'status': 'error', 'message': 'Unknown upload session'}), 404
 
-    chunk_save_path = os.path.join(temp_dir, f"{file_name}_chunk_{chunk_number}")
-    chunk.save(chunk_save_path)
-
-    if chunk_number == total_chunks - 1:
-        assembled_file_path = os.path.join(temp_dir, file_name)
-        with open(assembled_file_path, 'wb') as final_file:
-            for i in range(total_chunks):
-                chunk_file_path = os.path.join(temp_dir, f"{file_name}_chunk_{i}")
-                with open(chunk_file_path, 'rb') as chunk_file:
-                    final_file.write(chunk_file.read())
-                os.remove(chunk_file_path)
-
-        # Move the assembled file to the final upload folder
-        final_file_path = os.path.join(upload_folder, file_name)
-        shutil.move(assembled_file_path, final_file_path)
-
-        # Cleanup the temporary directory
-        shutil.rmtree(temp_dir)
-        globals().pop('temp_dir', None)
+    try:
+        final_file_path = receive_chunk(session_id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
+    if final_file_path:
         # Emit progress update
         progress = 100
         message = 'File upload complete'
@@ -130,63 +151,52 @@ async def process_file_endpoint():
     result = await process_file(file_path)
     return jsonify({'status': 'success', 'message': result[0], 'downloadLink': result[1], 'signaturesCount': result[2]})
 
-def generate_temp_dir(suffix):
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'temp_{timestamp}_{suffix}')
-    os.makedirs(temp_dir, exist_ok=True)
-    return temp_dir
+@app.route('/jobs', methods=['POST'])
+async def create_job():
+    data = request.get_json()
+    file_paths = data.get('filePaths', [])
+    if not file_paths or not all(os.path.isfile(file_path) for file_path in file_paths):
+        return jsonify({'status': 'error', 'message': 'Invalid file path'}), 400
+
+    job_id = enqueue_files(file_paths)
+    return jsonify({'status': 'success', 'job_id': job_id, 'total_files': len(file_paths)}), 202
+
+@app.route('/jobs/<job_id>')
+async def job_status(job_id):
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(job)
 
 @app.route('/upload_chunk', methods=['POST'])
 def upload_chunk():
-    chunk = request.files['chunk']
-    file_name = request.form['fileName']
-    chunk_number = int(request.form['chunkNumber'])
-    total_chunks = int(request.form['totalChunks'])
+    session_id = request.form.get('sessionId', '')
     folder = request.form['folder']
+    if folder not in ('folder1', 'folder2'):
+        return jsonify({'status': 'error', 'message': 'Invalid folder'}), 400
+    if not upload_sessions.exists(session_id):
+        return jsonify({'status': 'error', 'message': 'Unknown upload session'}), 404
 
-    # Generate temporary directories
-    if folder == 'folder1':
-        if 'temp_dir1' not in globals():
-            globals()['temp_dir1'] = generate_temp_dir('1')
-        temp_dir = globals()['temp_dir1']
-    else:
-        if 'temp_dir2' not in globals():
-            globals()['temp_dir2'] = generate_temp_dir('2')
-        temp_dir = globals()['temp_dir2']
-
-    os.makedirs(temp_dir, exist_ok=True)
-
-    chunk_save_path = os.path.join(temp_dir, f"{file_name}_chunk_{chunk_number}")
-    chunk.save(chunk_save_path)
-
-    if chunk_number == total_chunks - 1:
-        with open(os.path.join(temp_dir, file_name), 'wb') as final_file:
-            for i in range(total_chunks):
-                chunk_file_path = os.path.join(temp_dir, f"{file_name}_chunk_{i}")
-                with open(chunk_file_path, 'rb') as chunk_file:
-                    final_file.write(chunk_file.read())
-                os.remove(chunk_file_path)
+    try:
+        receive_chunk(session_id, folder)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
     return jsonify({'status': 'success'})
 
 @app.route('/upload_folders', methods=['POST'])
 def upload_folders():
     try:
-        folder1_files = request.files.getlist('folder1')
-        folder2_files = request.files.getlist('folder2')
+        session_id = request.form.get('sessionId', '')
+        if not upload_sessions.exists(session_id):
+            return jsonify({'status': 'error', 'message': 'Unknown upload session'}), 404
 
-        temp_dir1 = globals()['temp_dir1']
-        temp_dir2 = globals()['temp_dir2']
+        for folder in ('folder1', 'folder2'):
+            for file in request.files.getlist(folder):
+                file.filename = secure_filename(os.path.basename(file.filename))
+                upload_sessions.save_file(session_id, file, folder)
 
-        for file in folder1_files:
-            filename = secure_filename(os.path.basename(file.filename))
-            file.save(os.path.join(temp_dir1, filename))
-
-        for file in folder2_files:
-            filename = secure_filename(os.path.basename(file.filename))
-            file.save(os.path.join(temp_dir2, filename))
-
-        logging.debug(f'Files uploaded to temporary directories: {temp_dir1}, {temp_dir2}')
+        logging.debug(f'Files uploaded to upload session {session_id}')
         return jsonify({'status': 'success'})
     except Exception as e:
         logging.error(f'Error in upload_folders: {str(e)}')
@@ -195,18 +205,22 @@ def upload_folders():
 @app.route('/compare_pdfs', methods=['POST'])
 def compare_pdfs_route():
     try:
-        temp_dir1 = globals().get('temp_dir1')
-        temp_dir2 = globals().get('temp_dir2')
-
-        if not temp_dir1 or not temp_dir2:
+        data = request.get_json(silent=True) or {}
+        session_id = data.get('sessionId', '')
+        if not upload_sessions.exists(session_id):
             return jsonify({'matches': [], 'mismatches': []})
 
-        result = compare_pdf_folders_in_parallel(temp_dir1, temp_dir2, app.config['MISMATCH_DIR'], app.config['MATCH_DIR'])
+        session_dir = upload_sessions.session_dir(session_id)
+        folder1 = os.path.join(session_dir, 'folder1')
+        folder2 = os.path.join(session_dir, 'folder2')
 
-        shutil.rmtree(temp_dir1)
-        shutil.rmtree(temp_dir2)
-        globals().pop('temp_dir1', None)
-        globals().pop('temp_dir2', None)
+        def compare_progress(result, file, compared):
+            socketio.emit('compare_progress', {'compared': compared, 'result': result, 'file': file})
+
+        result = compare_pdf_folders_in_parallel(folder1, folder2, app.config['MISMATCH_DIR'], app.config['MATCH_DIR'],
+                                                 on_result=compare_progress)
+
+        upload_sessions.delete(session_id)
 
         return jsonify({'matches': result["matches"], 'mismatches': result["mismatches"]})
     except Exception as e:
@@ -281,6 +295,7 @@ async def clear_matched_folder():
 async def clear_compare_img_folder():
     folders_to_clear = [app.config['BASELINE_IMG'], app.config['CHANGED_IMG']]
     try:
+        clear_deferred_artifacts()
         for folder in folders_to_clear:
             for filename in os.listdir(folder):
                 file_path = os.path.join(folder, filename)
@@ -292,17 +307,26 @@ async def clear_compare_img_folder():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def delayed_cleanup(path, delay=10):
-    def cleanup():
-        time.sleep(delay)
-        try:
-            if os.path.exists(path):
-                shutil.rmtree(path)
-        except Exception as e:
-            app.logger.error(f'Error during delayed cleanup: {e}')
-
-    thread = threading.Thread(target=cleanup)
-    thread.start()
+def filter_download_files(directory, since=None, until=None, min_signatures=None, max_signatures=None):
+    """Files of a download folder, optionally limited to a modification date range and a signature count range."""
+    for filename in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, filename)
+        if filename.startswith('.') or not os.path.isfile(file_path):
+            # Hidden files are outputs still being written
+            continue
+        if since or until:
+            modified = datetime.fromtimestamp(os.path.getmtime(file_path))
+            if (since and modified < since) or (until and modified >= until):
+                continue
+        if min_signatures is not None or max_signatures is not None:
+            try:
+                num_signatures = utils.extract_num_signatures(filename)
+            except (ValueError, IndexError):
+                continue
+            if (min_signatures is not None and num_signatures < min_signatures) or \
+                    (max_signatures is not None and num_signatures > max_signatures):
+                continue
+        yield file_path
 
 @app.route('/download/<download_type>')
 def download_files(download_type):
@@ -319,23 +343,27 @@ def download_files(download_type):
         else:
             return jsonify({"status": "error", "message": "Invalid download type"}), 400
 
-        files = os.listdir(directory)
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-
-        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(__file__)))
-        zip_filename = os.path.join(temp_dir, f'{zip_prefix}_{timestamp}.zip')
+        compression = request.args.get('compression', ZIP_COMPRESSION)
+        if compression not in ZIP_COMPRESSION_MODES:
+            return jsonify({"status": "error", "message": "Invalid compression"}), 400
 
-        with zipfile.ZipFile(zip_filename, 'w') as zipf:
-            for filename in files:
-                file_path = os.path.join(directory, filename)
-                zipf.write(file_path, os.path.basename(file_path))
+        # Optional filters: ?since=YYYY-MM-DD&until=YYYY-MM-DD (exclusive)&min_signatures=N&max_signatures=N
+        # A filter that can't be parsed is an error rather than being dropped, which would send the whole folder
+        filters = {}
+        for name, parse in (('since', datetime.fromisoformat), ('until', datetime.fromisoformat),
+                            ('min_signatures', int), ('max_signatures', int)):
+            value = request.args.get(name)
+            try:
+                filters[name] = parse(value) if value else None
+            except ValueError:
+                return jsonify({"status": "error", "message": f"Invalid {name}: {value}"}), 400
 
-        @after_this_request
-        def remove_file(response):
-            delayed_cleanup(temp_dir)
-            return response
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_paths = list(filter_download_files(directory, **filters))
 
-        return send_file(zip_filename, as_attachment=True)
+        # The archive is built while it is sent, without a temp file
+        return Response(stream_zip(file_paths, compression), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={zip_prefix}_{timestamp}.zip'})
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -352,7 +380,7 @@ async def get_keywords():
 @app.route('/notifications')
 async def notifications():
     page = request.args.get('page', 1, type=int)
-    notifications, total_pages = await get_notifications(page=page, output_folder=app.config['OUTPUT_FOLDER'])
+    notifications, total_pages = await get_notifications(page=page)
     return render_template('notifications.html', notifications=notifications, page=page, total_pages=total_pages)
 
 @app.route('/upload', methods=['GET', 'POST'])
@@ -382,11 +410,45 @@ async def get_compare_images():
                 'bounding_box': os.path.join(bounding_dir, bounding)
             })
 
+        # Diff images the comparisons only recorded (lazy ArtifactMode) are rendered when requested
+        for artifact in deferred_artifacts.list():
+            images.append({
+                'original': url_for('get_compare_image', artifact_id=artifact['id'], kind='original'),
+                'bounding_box': url_for('get_compare_image', artifact_id=artifact['id'], kind='bounding_box'),
+                'name': artifact_writer.filename(artifact['pdf1_name'], artifact['page_num'])
+            })
+
         return jsonify({'images': images})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/compare_image/<int:artifact_id>/<kind>', methods=['GET'])
+async def get_compare_image(artifact_id, kind):
+    try:
+        # Checked first so a browser revalidating an image of cleared comparison results gets a 404, not a 304
+        if kind not in ('original', 'bounding_box') or deferred_artifacts.get(artifact_id) is None:
+            return jsonify({'error': 'Image not found'}), 404
+
+        # The image behind an artifact id never changes, so browsers may keep it and revalidate with the ETag
+        etag = f'{artifact_id}-{kind}-{artifact_writer.image_format}'
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            image = render_artifact_image(artifact_id, kind)
+            if image is None:
+                return jsonify({'error': 'Image not found'}), 404
+            response = send_file(io.BytesIO(image), mimetype=artifact_writer.mimetype, etag=False, max_age=86400)
+        response.set_etag(etag)
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = 86400
+        return response
+
+    except Exception as e:
+        logging.error(f'Error rendering compare image {artifact_id}/{kind}: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/uploads/<filename>')
 async def download_file(filename):
     return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
@@ -396,7 +458,7 @@ async def clear_upload_dir():
     try:
         for filename in os.listdir(app.config['UPLOAD_FOLDER']):
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.isfile(file_path) or os.link(file_path):
+            if os.path.isfile(file_path) or os.path.islink(file_path):
                 os.unlink(file_path)
             elif os.path.isdir(file_path):
                 shutil.rmtree(file_path)
@@ -413,6 +475,7 @@ async def clear_output_directory():
                 os.unlink(file_path)
             elif os.path.isdir(file_path):
                 shutil.rmtree(file_path)
+        output_index.clear()
         return jsonify({"status": "success"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -421,6 +484,7 @@ async def clear_output_directory():
 async def set_keywords():
     data = request.get_json()  # Synchronous call
     keyword_option = data.get('keyword_option')
+    previous_fingerprint = signature_detector.keyword_matcher.fingerprint
 
     if keyword_option == 'default':
         signature_detector.load_default_keywords()
@@ -434,14 +498,22 @@ async def set_keywords():
         await signature_detector.save_keywords_to_json('data/manualKeywords.json', primary_keywords_list,
                                                        secondary_keywords_list)
 
+    # Cached detection results are only valid for the keywords they were computed with
+    if signature_detector.keyword_matcher.fingerprint != previous_fingerprint:
+        detection_cache.clear()
+
     return jsonify({'message': 'Keywords updated successfully'})
 
+@app.route('/detection_cache_stats')
+async def detection_cache_stats():
+    return jsonify(detection_cache.stats())
+
 @app.route('/detect_signature_pages', methods=['POST'])
 async def detect_signature_pages():
     data = await request.get_json()  # Synchronous call
     pdf_path = data['pdf_path']
-    pdf_reader = PdfReader(pdf_path)
-    pages = await signature_detector.detect_signature_pages(pdf_reader, pdf_path)
+    with signature_detector.open_document(pdf_path) as document:
+        pages = await signature_detector.detect_signature_pages(document)
     return jsonify({'pages': pages})
 
 @app.route('/extract_signature_pages', methods=['POST'])
@@ -449,15 +521,13 @@ async def extract_signature_pages():
     data = await request.get_json()  # Synchronous call
     pdf_path = data['pdf_path']
     output_path = data['output_path']
-    reader = PdfReader(pdf_path)
-    pages = await signature_detector.detect_signature_pages(reader, pdf_path)
 
-    with tempfile.TemporaryDirectory() as temp_output_dir:
-        temp_pdf_path = os.path.join(temp_output_dir, "extracted_signatures.pdf")
+    with signature_detector.open_document(pdf_path) as document:
+        pages = await signature_detector.detect_signature_pages(document)
 
         try:
-            await signature_detector.extract_signature_pages(reader, pages, temp_pdf_path)
-            shutil.move(temp_pdf_path, output_path)
+            # Written to a temp file beside output_path and renamed into place
+            await signature_detector.extract_signature_pages(document, pages, output_path)
 
             return jsonify({'status': 'success', 'message': 'Signature pages extracted successfully', 'output_path': output_path})
         except Exception as e:
@@ -465,25 +535,15 @@ async def extract_signature_pages():
 
 @app.route('/export-file-names')
 async def export_file_names():
-    output_folder = app.config['OUTPUT_FOLDER']
-    all_files = utils.get_all_files(output_folder)
-    processed_files = []
-
-    for file_path in all_files:
-        file_name = os.path.basename(file_path)
-        processed_time = os.path.getmtime(file_path)
-        processed_files.append({
-            "title": file_name,
-            "timestamp": processed_time
-        })
-
-    pdf_buffer = utils.generate_pdf(processed_files, output_folder)
-    return send_file(pdf_buffer, as_attachment=True, download_name='processed_files.pdf', mimetype='application/pdf')
+    # The report is rebuilt from the output index only when outputs changed, and sent from disk in chunks
+    report_path, generation = report_cache.get()
+    return send_file(report_path, as_attachment=True, download_name='processed_files.pdf', mimetype='application/pdf',
+                     etag=f'processed-files-{generation}', max_age=0)
 
 @app.route('/report')
 async def report():
-    notifications = await get_all_notifications(output_folder=app.config['OUTPUT_FOLDER'])
-    return render_template('report.html', notifications=notifications)
+    # Rows are rendered as they are read from the output index
+    return stream_template('report.html', notifications=iter_all_notifications())
 
 if __name__ == '__main__':
     socketio.run(app, debug=True)
@@ -0,0 +1,80 @@
+"""
+Compares the text similarity engines on page text from the bundled PDFs and on synthetic dense pages.
+
+    python -m benchmarks.text_similarity_benchmark
+
+For every case it prints both scores, whether they agree on TextSimilarityThreshold, and the time taken.
+"""
+import glob
+import random
+import time
+
+import fitz  # PyMuPDF
+
+from src.pdf_compare import text_similarity_threshold
+from src.text_similarity import fast_similarity, sequence_similarity
+
+COMMON_WORDS = ['the', 'insured', 'policy', 'coverage', 'shall', 'premium', 'broker', 'signature', 'named', 'endorsement',
+                'liability', 'limit', 'applicant', 'provided', 'that', 'any', 'such', 'loss', 'payee', 'mortgagee']
+WORDS = COMMON_WORDS * 50 + [''.join(random.Random(i).choices('abcdefghijklmnopqrstuvwxyz', k=3 + i % 8)) for i in range(3000)]
+# Forms padded with a few repeated words (underscores, dots, "N/A") give diffs the fewest unique words to align on
+LOW_VOCABULARY_WORDS = ['____', '....', 'N/A', 'Yes', 'No']
+
+
+def synthetic_page(rng, words=2500, vocabulary=WORDS):
+    lines = []
+    for _ in range(words // 12):
+        lines.append(' '.join(rng.choice(vocabulary) for _ in range(12)) + '    ')
+    return '\n'.join(lines)
+
+
+def edit(rng, text, changes, vocabulary=WORDS):
+    tokens = text.split(' ')
+    for _ in range(changes):
+        tokens[rng.randrange(len(tokens))] = rng.choice(vocabulary).upper()
+    return ' '.join(tokens)
+
+
+def pdf_cases():
+    for pdf_path in sorted(glob.glob('match/*.pdf') + glob.glob('misMatch/*.pdf')):
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                text = page.get_text()
+                if text.strip():
+                    yield f'{pdf_path} p{page.number + 1}', text, text.replace('Insured', 'Insurer', 1)
+                    break
+
+
+def synthetic_cases(rng):
+    base = synthetic_page(rng)
+    yield 'synthetic identical', base, base
+    for changes in (5, 50, 200, 800):
+        yield f'synthetic {changes} edits', base, edit(rng, base, changes)
+    yield 'synthetic unrelated', base, synthetic_page(rng)
+    base = synthetic_page(rng, words=16000, vocabulary=LOW_VOCABULARY_WORDS)
+    yield 'synthetic low vocabulary 50 edits', base, edit(rng, base, 50, LOW_VOCABULARY_WORDS)
+
+
+def timed(function, text1, text2):
+    start = time.perf_counter()
+    score = function(text1, text2)
+    return score, time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'case':60} {'sequence':>9} {'fast':>9} {'agree':>6} {'seq ms':>10} {'fast ms':>9}")
+    totals = [0.0, 0.0]
+    for name, text1, text2 in list(pdf_cases()) + list(synthetic_cases(rng)):
+        sequence_score, sequence_time = timed(sequence_similarity, text1, text2)
+        fast_score, fast_time = timed(fast_similarity, text1, text2)
+        agree = (sequence_score >= text_similarity_threshold) == (fast_score >= text_similarity_threshold)
+        totals[0] += sequence_time
+        totals[1] += fast_time
+        print(f'{name[-60:]:60} {sequence_score:9.4f} {fast_score:9.4f} {str(agree):>6} '
+              f'{sequence_time * 1000:10.2f} {fast_time * 1000:9.2f}')
+    print(f"{'total':60} {'':9} {'':9} {'':6} {totals[0] * 1000:10.2f} {totals[1] * 1000:9.2f}")
+
+
+if __name__ == '__main__':
+    main()
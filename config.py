@@ -16,5 +16,31 @@ FOLDER2_DIR = os.getenv('FOLDER2_DIR', 'folder2')
 ALLOWED_EXTENSIONS = {'pdf'}
 SECRET_KEY = os.getenv('SECRET_KEY', 'formsteam')
 MAX_CONTENT_LENGTH = 10 * 1024 * 1024 * 1024  # 10 GB
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # Chunk size the upload pages use, for clients that don't send chunkSize
 BATCH_SIZE = 50  # Set the desired batch size
-
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pymupdf')  # 'pymupdf' or 'pypdf2', see src/pdf_backends.py
+DETECTION_SIGNATURE_WIDGETS = os.getenv('DETECTION_SIGNATURE_WIDGETS', 'false').lower() in ('1', 'true', 'yes')  # Pages with signature form fields count without a text check (secondary keywords don't exclude them)
+DETECTION_LAST_N_PAGES = int(os.getenv('DETECTION_LAST_N_PAGES', 0))  # Only scan the last N pages; 0 scans every page
+DETECTION_PAGE_RANGE = os.getenv('DETECTION_PAGE_RANGE', '')  # Only scan these pages, e.g. '1-5' (1-based, inclusive)
+DETECTION_MAX_SIGNATURES = int(os.getenv('DETECTION_MAX_SIGNATURES', 0))  # Keep only the first N signature pages in page order; 0 for no limit
+OCR_DPI = int(os.getenv('OCR_DPI', 200))  # Resolution pages are rasterized at for OCR
+OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', min(4, os.cpu_count())))
+DETECTION_CACHE_PATH = os.getenv('DETECTION_CACHE_PATH', 'data/detection_cache.db')
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv('DETECTION_CACHE_MAX_ENTRIES', 10000))
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH', 'data/ocr_cache.db')
+OCR_CACHE_MAX_ENTRIES = int(os.getenv('OCR_CACHE_MAX_ENTRIES', 50000))
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'data/jobs.db')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', os.cpu_count()))  # Files processed concurrently by the job queue
+FILES_PER_TASK = int(os.getenv('FILES_PER_TASK', 8))  # Files sent to a detection worker process at once
+SHARD_MIN_BYTES = int(os.getenv('SHARD_MIN_BYTES', 1024 * 1024))  # Smaller uploads are never sharded, so they aren't opened to count pages
+SHARD_MIN_PAGES = int(os.getenv('SHARD_MIN_PAGES', 200))  # Documents with this many pages to scan are split into page shards
+SHARD_PAGES = int(os.getenv('SHARD_PAGES', 50))  # Pages per shard
+SAVE_BLOCK_SIZE = int(os.getenv('SAVE_BLOCK_SIZE', 1024 * 1024))  # Block size uploaded files are copied to disk in
+SAVE_MAX_BYTES_IN_FLIGHT = int(os.getenv('SAVE_MAX_BYTES_IN_FLIGHT', 64 * 1024 * 1024))  # Upload bytes buffered across concurrent saves
+OUTPUT_INDEX_PATH = os.getenv('OUTPUT_INDEX_PATH', 'data/output_index.db')  # Metadata of the processed outputs
+REPORT_CACHE_FOLDER = os.getenv('REPORT_CACHE_FOLDER', 'data/reports')  # Exported processed files reports
+UPLOAD_SESSIONS_DB_PATH = os.getenv('UPLOAD_SESSIONS_DB_PATH', 'data/upload_sessions.db')
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))  # Seconds before an abandoned upload session is removed
+ZIP_COMPRESSION = os.getenv('ZIP_COMPRESSION', 'stored')  # 'stored' or 'deflated' for /download archives
+COMPARE_ARTIFACTS_DB_PATH = os.getenv('COMPARE_ARTIFACTS_DB_PATH', 'data/compare_artifacts.db')
+COMPARE_SOURCES_FOLDER = os.getenv('COMPARE_SOURCES_FOLDER', 'data/compare_sources')  # PDFs kept for deferred diff images
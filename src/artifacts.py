@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+import cv2
+
+from src.sqlite_store import SQLiteStore
+from src.utils import file_sha256
+
+# Encoder settings per artifact format; `level` is the PNG compression level or the JPEG/WebP quality
+IMAGE_FORMATS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 'image/png'),
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 'image/jpeg'),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 'image/webp')
+}
+
+
+def artifact_filename(pdf_path, page_num, image_format='png'):
+    extension, _, _ = IMAGE_FORMATS.get(image_format, IMAGE_FORMATS['png'])
+    return os.path.splitext(os.path.basename(pdf_path))[0] + f'_Page_{page_num + 1}{extension}'
+
+
+class ArtifactWriter:
+    """
+    Encodes and writes diff images on a background thread so comparison workers don't wait on the encoder.
+    The queue is bounded: once it is full, `write` blocks, which keeps memory use flat when encoding falls behind.
+    """
+
+    def __init__(self, image_format='png', level=1, max_queue=16):
+        self.image_format = image_format if image_format in IMAGE_FORMATS else 'png'
+        self.params = [IMAGE_FORMATS[self.image_format][1], level]
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._created_dirs = set()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            # Checked per process, since a forked worker doesn't inherit the parent's thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='artifact-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            path, image = self._queue.get()
+            try:
+                directory = os.path.dirname(path)
+                if directory not in self._created_dirs:
+                    os.makedirs(directory, exist_ok=True)
+                    self._created_dirs.add(directory)
+                if not cv2.imwrite(path, image, self.params):
+                    logging.error(f"Error writing artifact {path}")
+            except Exception as e:
+                logging.error(f"Error writing artifact {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def filename(self, pdf_path, page_num):
+        return artifact_filename(pdf_path, page_num, self.image_format)
+
+    @property
+    def mimetype(self):
+        return IMAGE_FORMATS[self.image_format][2]
+
+    def encode(self, image):
+        """Encode an image in memory with the writer's format and level, for images that are served instead of written."""
+        success, buffer = cv2.imencode(IMAGE_FORMATS[self.image_format][0], image, self.params)
+        if not success:
+            raise ValueError(f"Could not encode image as {self.image_format}")
+        return buffer.tobytes()
+
+    def write(self, path, image):
+        self._start()
+        self._queue.put((path, image))
+
+    def flush(self):
+        """Block until every queued artifact is on disk."""
+        self._queue.join()
+
+
+class DeferredArtifactStore(SQLiteStore):
+    """
+    Records what is needed to draw a diff artifact (both PDFs, the page and its diff boxes) instead of drawing it.
+    Ids are never reused (AUTOINCREMENT), so an id always refers to the same image and can be cached by clients.
+    The PDFs are copied into sources_folder, keyed by content hash, because the compare upload folders are
+    removed once a comparison finishes.
+    """
+
+    def __init__(self, db_path, sources_folder):
+        super().__init__(db_path)
+        self.sources_folder = sources_folder
+
+    def _create_schema(self, conn):
+        os.makedirs(self.sources_folder, exist_ok=True)
+        conn.execute('''CREATE TABLE IF NOT EXISTS artifacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pdf1_name TEXT NOT NULL,
+            pdf2_name TEXT NOT NULL,
+            pdf1_source TEXT NOT NULL,
+            pdf2_source TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            boxes TEXT NOT NULL,
+            detail_zoom REAL NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+
+    def keep_source(self, pdf_path):
+        """Copy a PDF into sources_folder (once per content) and return the copy's path, for `record`."""
+        source_path = os.path.join(self.sources_folder, f'{file_sha256(pdf_path)}.pdf')
+        if not os.path.exists(source_path):
+            os.makedirs(self.sources_folder, exist_ok=True)
+            temp_path = f'{source_path}.{os.getpid()}.tmp'
+            shutil.copyfile(pdf_path, temp_path)
+            os.replace(temp_path, source_path)
+        return source_path
+
+    def record(self, pdf1_path, pdf2_path, pdf1_source, pdf2_source, page_num, boxes, detail_zoom):
+        """Record one differing page; the sources are the kept copies of both PDFs, made once per pair with keep_source."""
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute('''INSERT INTO artifacts (pdf1_name, pdf2_name, pdf1_source, pdf2_source, page_num,
+                                         boxes, detail_zoom, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                      (os.path.basename(pdf1_path), os.path.basename(pdf2_path), pdf1_source, pdf2_source,
+                                       page_num, json.dumps(boxes), detail_zoom, time.time()))
+                return cursor.lastrowid
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_artifact(row):
+        return {
+            'id': row[0], 'pdf1_name': row[1], 'pdf2_name': row[2], 'pdf1_source': row[3], 'pdf2_source': row[4],
+            'page_num': row[5], 'boxes': json.loads(row[6]), 'detail_zoom': row[7]
+        }
+
+    def list(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('''SELECT id, pdf1_name, pdf2_name, pdf1_source, pdf2_source, page_num, boxes, detail_zoom
+                                   FROM artifacts ORDER BY pdf1_name, page_num, id''').fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_artifact(row) for row in rows]
+
+    def get(self, artifact_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('''SELECT id, pdf1_name, pdf2_name, pdf1_source, pdf2_source, page_num, boxes, detail_zoom
+                                  FROM artifacts WHERE id = ?''', (artifact_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_artifact(row) if row else None
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM artifacts')
+        finally:
+            conn.close()
+        shutil.rmtree(self.sources_folder, ignore_errors=True)
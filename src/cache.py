@@ -0,0 +1,92 @@
+import json
+import logging
+import sqlite3
+import time
+
+from config import DETECTION_CACHE_PATH, DETECTION_CACHE_MAX_ENTRIES, OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES
+from src.sqlite_store import SQLiteStore
+
+
+class PersistentLRUCache(SQLiteStore):
+    """
+    Small key/value cache stored in SQLite so it survives restarts and is shared by every worker process.
+    Values are stored as JSON. Once max_entries is exceeded the least recently used entries are evicted.
+    """
+
+    def __init__(self, db_path, max_entries):
+        super().__init__(db_path)
+        self.max_entries = max_entries
+
+    def _create_schema(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _increment(self, conn, name):
+        conn.execute('INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    row = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+                    if row is None:
+                        self._increment(conn, 'misses')
+                        return None
+                    conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+                    self._increment(conn, 'hits')
+                    return json.loads(row[0])
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading cache {self.db_path}: {e}")
+            return None
+
+    def set(self, key, value):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)',
+                                 (key, json.dumps(value), time.time()))
+                    count = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+                    if count > self.max_entries:
+                        conn.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)',
+                                     (count - self.max_entries,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error writing cache {self.db_path}: {e}")
+
+    def clear(self):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM entries')
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error clearing cache {self.db_path}: {e}")
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM stats').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'entries': entries,
+            'max_entries': self.max_entries
+        }
+
+
+# Signature pages per (file content hash, keyword fingerprint)
+detection_cache = PersistentLRUCache(DETECTION_CACHE_PATH, DETECTION_CACHE_MAX_ENTRIES)
+
+# OCR text per (rendered page pixels, OCR language)
+ocr_cache = PersistentLRUCache(OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES)
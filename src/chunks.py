@@ -0,0 +1,52 @@
+import os
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def partial_path(final_path):
+    """Where a file is assembled while its chunks arrive: a hidden file next to its final location."""
+    directory, filename = os.path.split(final_path)
+    return os.path.join(directory, f'.{filename}.part')
+
+
+def write_chunk(final_path, stream, offset, total_size=None, max_length=None):
+    """
+    Write one uploaded chunk straight to its byte offset in the partial file of `final_path`.
+    The chunk is copied from `stream` in fixed-size blocks, so memory use doesn't depend on the chunk or file size,
+    and chunks may arrive in any order. When `total_size` is known the file is preallocated on first write.
+    Raises ValueError, before writing past it, if the chunk is longer than `max_length`.
+    Returns the number of bytes written.
+    """
+    fd = os.open(partial_path(final_path), os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if total_size and os.fstat(fd).st_size < total_size:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+
+        written = 0
+        for block in iter(lambda: stream.read(COPY_BLOCK_SIZE), b''):
+            if max_length is not None and written + len(block) > max_length:
+                raise ValueError(f"Chunk at offset {offset} is longer than {max_length} bytes")
+            view = memoryview(block)
+            while view:
+                if hasattr(os, 'pwrite'):
+                    count = os.pwrite(fd, view, offset + written)
+                else:
+                    os.lseek(fd, offset + written, os.SEEK_SET)
+                    count = os.write(fd, view)
+                view = view[count:]
+                written += count
+        return written
+    finally:
+        os.close(fd)
+
+
+def finalize_chunks(final_path, total_size=None):
+    """Move the assembled file into place. The rename is atomic, so readers never see a half-written file."""
+    part = partial_path(final_path)
+    if total_size is not None:
+        os.truncate(part, total_size)
+    os.replace(part, final_path)
+    return final_path
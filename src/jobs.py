@@ -0,0 +1,275 @@
+import json
+import logging
+import shutil
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import JOBS_DB_PATH
+from src.sqlite_store import SQLiteStore
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class JobQueue(SQLiteStore):
+    """
+    Durable queue of processing jobs stored in SQLite.
+    A job is a set of uploaded files; every file is claimed and completed on its own so that
+    any number of worker threads or processes sharing the database can pull work from it.
+    A job stores the keywords it was queued with, so every worker detects with the same keywords whatever process it runs in.
+    claimed_at is refreshed by a heartbeat while a file is being processed, so only files whose worker died look stale.
+    """
+
+    isolation_level = None
+
+    def _create_schema(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            keywords TEXT,
+            folder TEXT
+        )''')
+        job_columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        for column in ('keywords', 'folder'):
+            if column not in job_columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+        conn.execute('''CREATE TABLE IF NOT EXISTS job_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            cleanup INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            message TEXT,
+            download_link TEXT,
+            signatures INTEGER,
+            claimed_at REAL,
+            content_hash TEXT
+        )''')
+        if 'content_hash' not in [row[1] for row in conn.execute('PRAGMA table_info(job_files)')]:
+            conn.execute('ALTER TABLE job_files ADD COLUMN content_hash TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS job_files_status ON job_files (status, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS job_files_job ON job_files (job_id, id)')
+
+    def create_job(self, filepaths, cleanup=False, job_id=None, content_hashes=None, keywords=None, folder=None):
+        """
+        Queue files as one job. content_hashes, when the caller already knows them, spare workers from hashing the files again.
+        keywords is the (primary, secondary) keyword lists to detect with; folder is removed once every file is processed.
+        """
+        job_id = job_id or new_job_id()
+        content_hashes = content_hashes or [None] * len(filepaths)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO jobs (id, total, created_at, keywords, folder) VALUES (?, ?, ?, ?, ?)',
+                         (job_id, len(filepaths), time.time(), json.dumps(keywords) if keywords is not None else None, folder))
+            conn.executemany('INSERT INTO job_files (job_id, filepath, cleanup, content_hash) VALUES (?, ?, ?, ?)',
+                             [(job_id, filepath, int(cleanup), content_hash)
+                              for filepath, content_hash in zip(filepaths, content_hashes)])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        logging.info(f"Queued job {job_id} with {len(filepaths)} files")
+        return job_id
+
+    def claim(self, limit=1):
+        """
+        Atomically mark up to `limit` queued files as running and return them as
+        (file_id, job_id, filepath, cleanup, content_hash, keywords).
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''SELECT job_files.id, job_id, filepath, cleanup, content_hash, jobs.keywords
+                                   FROM job_files JOIN jobs ON jobs.id = job_files.job_id
+                                   WHERE status = 'queued' ORDER BY job_files.id LIMIT ?''', (limit,)).fetchall()
+            if rows:
+                conn.executemany("UPDATE job_files SET status = 'running', claimed_at = ? WHERE id = ?",
+                                 [(time.time(), row[0]) for row in rows])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return [row[:5] + (tuple(json.loads(row[5])) if row[5] else None,) for row in rows]
+
+    def heartbeat(self, file_ids):
+        """Mark files as still being processed so requeue_stale leaves them alone."""
+        conn = self._connect()
+        try:
+            conn.executemany("UPDATE job_files SET claimed_at = ? WHERE id = ? AND status = 'running'",
+                             [(time.time(), file_id) for file_id in file_ids])
+        finally:
+            conn.close()
+
+    def complete(self, file_id, result, failed=False):
+        """Store the (message, download_link, signatures) result of a file and return its job's progress."""
+        message, download_link, signatures = result
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE job_files SET status = ?, message = ?, download_link = ?, signatures = ? WHERE id = ?',
+                         ('error' if failed else 'done', message, download_link, signatures, file_id))
+            job_id, = conn.execute('SELECT job_id FROM job_files WHERE id = ?', (file_id,)).fetchone()
+            processed, total = conn.execute(
+                "SELECT SUM(status IN ('done', 'error')), COUNT(*) FROM job_files WHERE job_id = ?", (job_id,)).fetchone()
+            folder, = conn.execute('SELECT folder FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        if folder and processed == total:
+            shutil.rmtree(folder, ignore_errors=True)
+            logging.debug(f"Removed folder {folder} of finished job {job_id}")
+        return job_id, processed, total
+
+    def requeue_stale(self, timeout):
+        """Put files whose worker hasn't sent a heartbeat for `timeout` seconds back in the queue (their worker went away)."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("UPDATE job_files SET status = 'queued', claimed_at = NULL WHERE status = 'running' AND claimed_at < ?",
+                                  (time.time() - timeout,))
+            if cursor.rowcount:
+                logging.warning(f"Requeued {cursor.rowcount} stale job files")
+        finally:
+            conn.close()
+
+    def get_job(self, job_id):
+        conn = self._connect()
+        try:
+            job = conn.execute('SELECT total, created_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = conn.execute('SELECT status, message, download_link, signatures FROM job_files WHERE job_id = ? ORDER BY id',
+                                 (job_id,)).fetchall()
+        finally:
+            conn.close()
+
+        total, created_at = job
+        finished = [row for row in files if row[0] in ('done', 'error')]
+        return {
+            'job_id': job_id,
+            'status': 'complete' if len(finished) == total else 'processing',
+            'created_at': created_at,
+            'total': total,
+            'processed': len(finished),
+            'progress': round(len(finished) / total * 100) if total else 100,
+            'messages': [row[1] for row in finished],
+            'download_links': [row[2] for row in finished],
+            'signatures_count': [row[3] for row in finished]
+        }
+
+
+class JobWorkerPool:
+    """
+    Long-lived dispatcher threads that pull files from a JobQueue and hand them to `handler` in batches.
+    `handler(filepaths, content_hashes, keywords)` returns one (message, download_link, signatures) tuple per file, like
+    process_file; a content hash is None when it wasn't known at enqueue time, and so are keywords for jobs queued without them.
+    `on_progress(job_id, processed, total)` is called after every finished file.
+    Files in progress get a heartbeat every `heartbeat_interval` seconds; files without one for `stale_timeout` seconds
+    belong to a worker that died and are queued again.
+    """
+
+    def __init__(self, queue, handler, num_workers, batch_size=1, on_progress=None, poll_interval=2.0, stale_timeout=300,
+                 heartbeat_interval=60):
+        self.queue = queue
+        self.handler = handler
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self._in_progress = set()
+        self._in_progress_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logging.info(f"Started {self.num_workers} job workers")
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _heartbeat(self):
+        while True:
+            try:
+                with self._in_progress_lock:
+                    file_ids = list(self._in_progress)
+                if file_ids:
+                    self.queue.heartbeat(file_ids)
+                self.queue.requeue_stale(self.stale_timeout)
+            except sqlite3.Error as e:
+                logging.error(f"Error sending job heartbeat: {e}")
+            time.sleep(self.heartbeat_interval)
+
+    def _run(self):
+        while True:
+            try:
+                claimed = self.queue.claim(self.batch_size)
+            except sqlite3.Error as e:
+                logging.error(f"Error claiming job files: {e}")
+                claimed = []
+
+            if not claimed:
+                # Other processes may enqueue too, so poll as well as waiting for a local notify
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            file_ids = [row[0] for row in claimed]
+            with self._in_progress_lock:
+                self._in_progress.update(file_ids)
+            try:
+                # A batch may span jobs queued with different keywords
+                by_keywords = {}
+                for row in claimed:
+                    by_keywords.setdefault(json.dumps(row[5]), []).append(row)
+                for rows in by_keywords.values():
+                    self._process(rows, rows[0][5])
+            except Exception as e:
+                logging.error(f"Error in job worker: {e}")
+            finally:
+                with self._in_progress_lock:
+                    self._in_progress.difference_update(file_ids)
+
+    def _process(self, claimed, keywords):
+        filepaths = [filepath for _, _, filepath, _, _, _ in claimed]
+        content_hashes = [content_hash for _, _, _, _, content_hash, _ in claimed]
+        failed = False
+        try:
+            results = self.handler(filepaths, content_hashes, keywords)
+        except Exception as e:
+            logging.error(f"Error processing queued files {filepaths}: {e}")
+            results = [(f'Error processing {os.path.basename(filepath)}.', None, 0) for filepath in filepaths]
+            failed = True
+
+        for (file_id, _, filepath, cleanup, _, _), result in zip(claimed, results):
+            if cleanup:
+                try:
+                    os.remove(filepath)
+                except OSError as e:
+                    logging.error(f"Error removing processed upload {filepath}: {e}")
+
+            job_id, processed, total = self.queue.complete(file_id, result, failed)
+            if self.on_progress:
+                try:
+                    self.on_progress(job_id, processed, total)
+                except Exception as e:
+                    logging.error(f"Error reporting progress for job {job_id}: {e}")
+
+
+job_queue = JobQueue(JOBS_DB_PATH)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import re
+
+
+def _trie_pattern(node):
+    # Turns a character trie into a regex where shared prefixes are only tried once,
+    # so a position in the text is checked against all keywords in a single step.
+    if '' in node and len(node) == 1:
+        return ''
+
+    alternatives = []
+    single_chars = []
+    for char in sorted(key for key in node if key != ''):
+        child = _trie_pattern(node[char])
+        if child:
+            alternatives.append(re.escape(char) + child)
+        else:
+            single_chars.append(re.escape(char))
+
+    optional = '' in node
+    if single_chars:
+        if len(single_chars) == 1:
+            alternatives.append(single_chars[0])
+        else:
+            alternatives.append('[' + ''.join(single_chars) + ']')
+
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+
+    pattern = '(?:' + '|'.join(alternatives) + ')'
+    if optional:
+        pattern += '?'
+    return pattern
+
+
+def compile_keywords(keywords):
+    """Compile a list of keywords into one regex that matches any of them, or None if the list is empty."""
+    if not keywords:
+        return None
+    if any(keyword == '' for keyword in keywords):
+        # An empty keyword matches every text, same as re.compile(re.escape('')) did
+        return re.compile('')
+
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return re.compile(_trie_pattern(trie))
+
+
+class KeywordMatcher:
+    """
+    Matches page text against the primary and secondary keyword sets in one pass per set.
+
+    Primary keywords are matched case-sensitively, secondary keywords case-insensitively,
+    which is how SignatureDetector has always treated them.
+    """
+
+    def __init__(self, primary_keywords, secondary_keywords):
+        self.primary_keywords = list(primary_keywords)
+        self.secondary_keywords = list(secondary_keywords)
+        self.primary_pattern = compile_keywords(self.primary_keywords)
+        self.secondary_pattern = compile_keywords([keyword.lower() for keyword in self.secondary_keywords])
+        self.fingerprint = hashlib.sha256(
+            json.dumps([self.primary_keywords, self.secondary_keywords]).encode('utf-8')).hexdigest()
+
+    def matches_primary(self, text):
+        return self.primary_pattern is not None and self.primary_pattern.search(text) is not None
+
+    def matches_secondary(self, text):
+        return self.secondary_pattern is not None and self.secondary_pattern.search(text.lower()) is not None
+
+    def is_signature_page(self, text):
+        """A page is a signature page when a primary keyword is present and no secondary keyword is."""
+        return self.matches_primary(text) and not self.matches_secondary(text)
@@ -1,54 +1,29 @@
 import os
 from datetime import datetime
 
-async def get_notifications(page=1, per_page=10, output_folder=None):
-    processed_files = []
-    all_files = [filename for filename in os.listdir(output_folder) if filename.endswith('.pdf')]
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_files = all_files[start:end]
-
-    for filename in paginated_files:
-        # Extracting num_signatures from the filename
-        num_signatures = int(filename.split("_")[-2])
-
-        try:
-            processed_time = datetime.fromtimestamp(os.path.getmtime(os.path.join(output_folder, filename)))
-        except FileNotFoundError:
-            continue
-
-        processed_files.append({
-            "title": "File Processed",
-            "message": f"{filename}.",
-            "timestamp": processed_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "signature": f"{num_signatures}",
-            "download_link": filename
-        })
-
-    total_pages = len(all_files) // per_page + (1 if len(all_files) % per_page > 0 else 0)
+from src.output_index import output_index
+
+
+def _notification(filename, processed_at, num_signatures):
+    return {
+        "title": "File Processed",
+        "message": f"{filename}.",
+        "timestamp": datetime.fromtimestamp(processed_at).strftime("%Y-%m-%d %H:%M:%S"),
+        "signature": f"{num_signatures}",
+        "download_link": filename
+    }
+
+async def get_notifications(page=1, per_page=10):
+    # Newest outputs first, straight from the output index
+    processed_files = [_notification(*row) for row in output_index.page(page, per_page)]
+    total = output_index.count()
+    total_pages = total // per_page + (1 if total % per_page > 0 else 0)
     return processed_files, total_pages
 
-async def get_all_notifications(output_folder=None):
-    processed_files = []
-    all_files = [filename for filename in os.listdir(output_folder) if filename.endswith('.pdf')]
-
-    for filename in all_files:
-        num_signatures = int(filename.split("_")[-2])
-
-        try:
-            processed_time = datetime.fromtimestamp(os.path.getmtime(os.path.join(output_folder, filename)))
-        except FileNotFoundError:
-            continue
-
-        processed_files.append({
-            "title": "File Processed",
-            "message": f"{filename}.",
-            "timestamp": processed_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "signature": f"{num_signatures}",
-            "download_link": filename
-        })
-
-    return processed_files
+def iter_all_notifications():
+    """Every notification, newest first, generated from the output index so a report can be streamed."""
+    for row in output_index.iter_all():
+        yield _notification(*row)
 
 def get_all_files(output_folder=None):
     all_files = [os.path.join(output_folder, filename) for filename in os.listdir(output_folder) if
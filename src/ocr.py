@@ -0,0 +1,21 @@
+import hashlib
+
+from pytesseract import image_to_string
+
+from src.cache import ocr_cache
+
+
+def ocr_image(image, lang='eng'):
+    """
+    OCR a PIL image, reusing the text from any earlier run on identical pixels.
+    Standard form pages repeat across documents, so the key is the hash of the rendered page and the language.
+    """
+    sha256 = hashlib.sha256(f'{lang}:{image.mode}:{image.size[0]}x{image.size[1]}:'.encode('utf-8'))
+    sha256.update(image.tobytes())
+    cache_key = sha256.hexdigest()
+
+    text = ocr_cache.get(cache_key)
+    if text is None:
+        text = image_to_string(image, lang=lang)
+        ocr_cache.set(cache_key, text)
+    return text
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from config import OUTPUT_FOLDER, OUTPUT_INDEX_PATH
+from src.sqlite_store import SQLiteStore
+from src.utils import extract_num_signatures
+
+
+class OutputIndex(SQLiteStore):
+    """
+    Metadata of the processed output PDFs (processed time, signature count, signature pages, source hash),
+    stored in SQLite so the notification pages and reports don't list and stat the output folder on every request.
+    process_file records each output it writes; `sync` picks up outputs the index doesn't know about yet.
+    Every change bumps `generation`, so anything derived from the index (like the exported report) knows when it is stale.
+    """
+
+    def __init__(self, db_path, output_folder):
+        super().__init__(db_path)
+        self.output_folder = output_folder
+        self._synced = None  # (pid, output folder mtime) of the last sync
+
+    def _create_schema(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS outputs (
+            filename TEXT PRIMARY KEY,
+            processed_at REAL NOT NULL,
+            signatures INTEGER NOT NULL,
+            pages TEXT,
+            source_hash TEXT
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS outputs_processed_at ON outputs (processed_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS outputs_generation (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER NOT NULL)')
+        conn.execute('INSERT OR IGNORE INTO outputs_generation (id, generation) VALUES (0, 0)')
+
+    @staticmethod
+    def _bump_generation(conn):
+        conn.execute('UPDATE outputs_generation SET generation = generation + 1 WHERE id = 0')
+
+    def record(self, filename, signatures, pages=None, source_hash=None, processed_at=None):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO outputs (filename, processed_at, signatures, pages, source_hash) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (filename, processed_at or time.time(), signatures,
+                                  json.dumps(pages) if pages is not None else None, source_hash))
+                    self._bump_generation(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error recording output {filename}: {e}")
+
+    def source_hash(self, filename):
+        """Hash of the upload the output was extracted from, or None if the output isn't indexed."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT source_hash FROM outputs WHERE filename = ?', (filename,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def sync(self):
+        """Reconcile the index with the output folder: add outputs it is missing and drop ones that were deleted."""
+        on_disk = {}
+        with os.scandir(self.output_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith('.pdf') and entry.is_file():
+                    on_disk[entry.name] = entry
+
+        conn = self._connect()
+        try:
+            indexed = {row[0] for row in conn.execute('SELECT filename FROM outputs')}
+            missing = []
+            for filename in on_disk.keys() - indexed:
+                try:
+                    signatures = extract_num_signatures(filename)
+                except (ValueError, IndexError):
+                    continue
+                missing.append((filename, on_disk[filename].stat().st_mtime, signatures))
+            deleted = indexed - on_disk.keys()
+            with conn:
+                conn.executemany('INSERT OR IGNORE INTO outputs (filename, processed_at, signatures) VALUES (?, ?, ?)', missing)
+                conn.executemany('DELETE FROM outputs WHERE filename = ?', [(filename,) for filename in deleted])
+                if missing or deleted:
+                    self._bump_generation(conn)
+        finally:
+            conn.close()
+        if missing:
+            logging.info(f"Indexed {len(missing)} existing outputs")
+
+    def _ensure_synced(self):
+        # Files added, renamed or deleted in the output folder outside process_file change the folder's mtime,
+        # so the folder is only scanned again when it did
+        mtime = os.stat(self.output_folder).st_mtime_ns
+        if self._synced == (os.getpid(), mtime):
+            return
+        self.sync()
+        # A change within the same timestamp tick as this sync would be missed, so a fresh mtime isn't trusted yet
+        if time.time_ns() - mtime > 1_000_000_000:
+            self._synced = (os.getpid(), mtime)
+
+    def generation(self):
+        """Counter that changes whenever an output is recorded, picked up by sync or cleared."""
+        self._ensure_synced()
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT generation FROM outputs_generation WHERE id = 0').fetchone()[0]
+        finally:
+            conn.close()
+
+    def count(self):
+        self._ensure_synced()
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+        finally:
+            conn.close()
+
+    def page(self, page=1, per_page=10):
+        """One page of outputs, newest first, as (filename, processed_at, signatures) rows."""
+        self._ensure_synced()
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT filename, processed_at, signatures FROM outputs '
+                                'ORDER BY processed_at DESC, filename LIMIT ? OFFSET ?',
+                                (per_page, (page - 1) * per_page)).fetchall()
+        finally:
+            conn.close()
+
+    def iter_all(self, batch_size=1000):
+        """Every output, newest first, fetched in batches so callers can stream them."""
+        self._ensure_synced()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('SELECT filename, processed_at, signatures FROM outputs ORDER BY processed_at DESC, filename')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM outputs')
+                self._bump_generation(conn)
+        finally:
+            conn.close()
+
+
+output_index = OutputIndex(OUTPUT_INDEX_PATH, OUTPUT_FOLDER)
@@ -0,0 +1,121 @@
+import fitz  # PyMuPDF
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+
+from config import PDF_BACKEND
+
+
+class PyMuPDFDocument:
+    """One open MuPDF document serves text extraction, rasterization for OCR and page extraction."""
+
+    name = 'pymupdf'
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.doc = fitz.open(pdf_path)
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def page_text(self, page_num):
+        """Text layer of the page; empty when the page has none (e.g. a scan)."""
+        return self.doc.load_page(page_num).get_text()
+
+    def signature_widget_pages(self):
+        """Pages carrying a signature form field, read from the form structure without touching page content."""
+        if not self.doc.is_form_pdf:
+            return []
+        return [page.number for page in self.doc
+                if next(page.widgets(types=[fitz.PDF_WIDGET_TYPE_SIGNATURE]), None) is not None]
+
+    def render_page(self, page_num, dpi):
+        zoom = dpi / 72
+        pix = self.doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    def extract_pages(self, page_nums, output_filepath):
+        # Selecting pages on a second handle keeps the original objects, so resources shared by the pages
+        # are written once (separate insert_pdf calls copy them again for every page) and nothing is re-serialized;
+        # garbage=1 drops the objects only the other pages used
+        with fitz.open(self.pdf_path) as output_doc:
+            output_doc.select(list(page_nums))
+            output_doc.save(output_filepath, garbage=1)
+
+    def close(self):
+        self.doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PyPDF2Document:
+    """PyPDF2 text extraction, as detection worked originally; pages are rasterized with MuPDF, opened only if OCR is needed."""
+
+    name = 'pypdf2'
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.reader = PdfReader(pdf_path)
+        self._render_doc = None
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_text(self, page_num):
+        return self.reader.pages[page_num].extract_text() or ''
+
+    def signature_widget_pages(self):
+        if '/AcroForm' not in self.reader.trailer['/Root']:
+            return []
+        pages = []
+        for page_num, page in enumerate(self.reader.pages):
+            for annot in page.get('/Annots') or []:
+                annot = annot.get_object()
+                if annot.get('/Subtype') != '/Widget':
+                    continue
+                # Widgets of a multi-widget field inherit the field type from their parent
+                field_type = annot.get('/FT') or ('/Parent' in annot and annot['/Parent'].get_object().get('/FT'))
+                if field_type == '/Sig':
+                    pages.append(page_num)
+                    break
+        return pages
+
+    def render_page(self, page_num, dpi):
+        if self._render_doc is None:
+            self._render_doc = fitz.open(self.pdf_path)
+        zoom = dpi / 72
+        pix = self._render_doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    def extract_pages(self, page_nums, output_filepath):
+        writer = PdfWriter()
+        for page_num in page_nums:
+            writer.add_page(self.reader.pages[page_num])
+        with open(output_filepath, 'wb') as output_pdf:
+            writer.write(output_pdf)
+
+    def close(self):
+        if self._render_doc is not None:
+            self._render_doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+PDF_BACKENDS = {
+    PyMuPDFDocument.name: PyMuPDFDocument,
+    PyPDF2Document.name: PyPDF2Document
+}
+
+
+def open_pdf(pdf_path, backend=None):
+    """Open a PDF with the configured backend (PDF_BACKEND) or the one named."""
+    return PDF_BACKENDS[backend or PDF_BACKEND](pdf_path)
@@ -1,73 +1,272 @@
 import os
+import functools
+import hashlib
+import itertools
+import re
 import shutil
 import fitz  # PyMuPDF
 import cv2
 import numpy as np
 import logging
-from difflib import SequenceMatcher
-import pytesseract
 from PIL import Image
-from skimage.metrics import structural_similarity as ssim
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import configparser
+from src.ocr import ocr_image
+from src.utils import file_sha256
+from src.text_similarity import SIMILARITY_ENGINES
+from src.regions import merge_boxes
+from src.artifacts import ArtifactWriter, DeferredArtifactStore
+from config import BASELINE_IMG_FOLDER, CHANGED_IMG_FOLDER, COMPARE_ARTIFACTS_DB_PATH, COMPARE_SOURCES_FOLDER
 
 # Configurable Parameters
 config = configparser.ConfigParser()
 config.read('data/config.ini')
 text_similarity_threshold = float(config['DEFAULT']['TextSimilarityThreshold'])
-image_similarity_threshold = float(config['DEFAULT']['ImageSimilarityThreshold'])
 ocr_language = config['DEFAULT']['OCRLanguage']
-batch_size = int(config['DEFAULT']['BatchSize'])
 max_workers = int(config['DEFAULT']['MaxWorkers'])
+execution_mode = config['DEFAULT'].get('ExecutionMode', 'thread')  # 'thread' or 'process'
+text_similarity_engine = config['DEFAULT'].get('TextSimilarityEngine', 'fast')  # 'fast' or 'sequence'
+diff_tile_size = int(config['DEFAULT'].get('DiffTileSize', 128))  # Pixels per side of a diff_tile_map tile
+
+default_render_profile = config['DEFAULT'].get('RenderProfile', 'screening')
+artifact_mode = config['DEFAULT'].get('ArtifactMode', 'background')  # 'background' or 'lazy' (rendered when viewed)
+artifact_format = config['DEFAULT'].get('ArtifactFormat', 'png')  # 'png', 'jpg' or 'webp'
+artifact_level = int(config['DEFAULT'].get('ArtifactLevel', 1))  # PNG compression level, or JPEG/WebP quality
+artifact_cache_size = int(config['DEFAULT'].get('ArtifactCacheSize', 64))  # Lazily rendered images kept in memory
+
+DETAIL_CLIP_MARGIN = 8  # Screening pixels added around a region before it is re-rendered at detail zoom
+
+# (screening zoom, detail zoom): every page is checked at the screening zoom and only differing
+# regions are rendered again at the detail zoom for the manual_compare images
+RENDER_PROFILES = {
+    'screening': (1.0, 2.0),
+    'full': (2.0, 2.0)
+}
 
 # Configure Logging
 logging.basicConfig(level=logging.DEBUG, filename='pdf_compare.log',
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+artifact_writer = ArtifactWriter(artifact_format, artifact_level)
+deferred_artifacts = DeferredArtifactStore(COMPARE_ARTIFACTS_DB_PATH, COMPARE_SOURCES_FOLDER)
+# Process workers may exit with the writer's queue still full, so they flush after every pair
+flush_artifacts_per_pair = False
+
+
+def init_compare_worker(text_threshold, language, similarity_engine):
+    # Worker processes get the parent's thresholds once instead of with every pair
+    global text_similarity_threshold, ocr_language, text_similarity_engine
+    global flush_artifacts_per_pair
+    flush_artifacts_per_pair = True
+    text_similarity_threshold = text_threshold
+    text_similarity_engine = similarity_engine
+    ocr_language = language
+
+
+def create_compare_executor(mode=None):
+    mode = mode or execution_mode
+    if mode == 'process':
+        # compare_pdfs is mostly GIL-bound Python, so processes are what actually use the cores
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=init_compare_worker,
+                                   initargs=(text_similarity_threshold, ocr_language, text_similarity_engine))
+    if mode != 'thread':
+        logging.warning(f"Unknown ExecutionMode {mode}, using threads")
+    return ThreadPoolExecutor(max_workers=max_workers)
+
 
 def text_similarity(text1, text2):
-    return SequenceMatcher(None, text1, text2).ratio()
+    return SIMILARITY_ENGINES.get(text_similarity_engine, SIMILARITY_ENGINES['fast'])(text1, text2)
 
 
 def extract_text_with_ocr(image):
     try:
-        return pytesseract.image_to_string(Image.fromarray(image), lang=ocr_language)
+        return ocr_image(Image.fromarray(image), lang=ocr_language)
     except Exception as e:
         logging.error(f"Error in OCR extraction: {e}")
         return ""
 
 
-def compare_images(image1, image2):
+def files_identical(pdf1_path, pdf2_path):
+    if os.path.getsize(pdf1_path) != os.path.getsize(pdf2_path):
+        return False
+    return file_sha256(pdf1_path) == file_sha256(pdf2_path)
+
+
+# Indirect references ("12 0 R") differ between otherwise identical files, so hashed objects name what they reference by its hash
+_OBJECT_REFERENCE = re.compile(rb'(\d+) \d+ R')
+# An annotation's back reference to its page would pull the whole page tree into the hash
+_PAGE_REFERENCE = re.compile(rb'/P \d+ \d+ R')
+
+
+def _object_digest(doc, xref, object_digests, visiting):
+    """Hash of an object, its raw stream and everything it references. Shared objects are hashed once per document."""
+    if xref in object_digests:
+        return object_digests[xref]
+    if xref in visiting:
+        return b'cycle'
+    visiting.add(xref)
+    sha256 = hashlib.sha256()
+    sha256.update(_resolve_references(doc, doc.xref_object(xref, compressed=True).encode('utf-8'), object_digests, visiting))
+    if doc.xref_is_stream(xref):
+        sha256.update(doc.xref_stream_raw(xref) or b'')
+    visiting.discard(xref)
+    object_digests[xref] = sha256.digest()
+    return object_digests[xref]
+
+
+def _resolve_references(doc, source, object_digests, visiting):
+    source = _PAGE_REFERENCE.sub(b'', source)
+    return _OBJECT_REFERENCE.sub(lambda match: _object_digest(doc, int(match.group(1)), object_digests, visiting).hex().encode('ascii'),
+                                 source)
+
+
+def _page_resources(doc, page):
+    """Source of the page's resource dictionary, which may be inherited from the page tree."""
+    xref = page.xref
+    while True:
+        kind, value = doc.xref_get_key(xref, 'Resources')
+        if kind != 'null':
+            return value.encode('utf-8')
+        kind, value = doc.xref_get_key(xref, 'Parent')
+        if kind != 'xref':
+            return b''
+        xref = int(value.split()[0])
+
+
+def page_fingerprint(doc, page, object_digests=None):
+    """
+    Hash of everything that decides how a page renders without rasterizing it: geometry, the content stream,
+    the whole resource tree it draws with (fonts, images, form XObjects, graphics states, colour spaces, patterns
+    and shadings, streams included), and its annotations and form fields with their appearance streams.
+    Object numbers are left out since they differ between otherwise identical files.
+    object_digests caches object hashes across the pages of one document.
+    """
+    object_digests = {} if object_digests is None else object_digests
+    visiting = set()
+    sha256 = hashlib.sha256()
+    sha256.update(f'{tuple(page.rect)}:{page.rotation}'.encode('utf-8'))
+    sha256.update(page.read_contents())
+    sha256.update(_resolve_references(doc, _page_resources(doc, page), object_digests, visiting))
+    # Filled-in forms are mostly annotations and widgets, which live outside the page content
+    for annot_xref, _, _ in page.annot_xrefs():
+        sha256.update(_object_digest(doc, annot_xref, object_digests, visiting))
+    return sha256.digest()
+
+
+def diff_tile_map(image1, image2, tile_size=None):
+    """
+    Coarse difference map that tells the bounding box stage where to look: one boolean per tile_size x tile_size tile,
+    True where any pixel of any channel differs.
+    """
+    tile_size = tile_size or diff_tile_size
+    diff = cv2.absdiff(image1, image2)
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+    tiles_y = -(-diff.shape[0] // tile_size)
+    tiles_x = -(-diff.shape[1] // tile_size)
+    padded = np.zeros((tiles_y * tile_size, tiles_x * tile_size), dtype=diff.dtype)
+    padded[:diff.shape[0], :diff.shape[1]] = diff
+    return padded.reshape(tiles_y, tile_size, tiles_x, tile_size).max(axis=(1, 3)) > 0
+
+
+def render_page(page, zoom, clip=None):
+    """Render a page (or the clip part of it) and return the pixels plus the pixmap's top-left offset."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n), (pix.x, pix.y)
+
+
+def find_diff_boxes(img1, img2, tile_map, size_threshold=20):
+    # Threshold differences only inside differing tiles, then box every significant contour
+    thresh = np.zeros(img1.shape[:2], dtype=np.uint8)
+    for ty, tx in zip(*np.nonzero(tile_map)):
+        y1, x1 = ty * diff_tile_size, tx * diff_tile_size
+        y2, x2 = y1 + diff_tile_size, x1 + diff_tile_size
+        diff_img = cv2.absdiff(img1[y1:y2, x1:x2], img2[y1:y2, x1:x2])
+        diff_gray = cv2.cvtColor(diff_img, cv2.COLOR_BGR2GRAY)
+        _, thresh[y1:y2, x1:x2] = cv2.threshold(diff_gray, 30, 255, cv2.THRESH_BINARY)
+
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    bounding_boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h > size_threshold:
+            bounding_boxes.append([x, y, x + w, y + h])
+    return bounding_boxes
+
+
+def render_diff_regions(page1, page2, screen1, screen2, regions, screening_zoom, detail_zoom):
+    """
+    Build detail-resolution page images without rendering whole pages at detail resolution: the screening
+    images are upscaled and only the regions that differ are re-rendered at detail zoom and pasted in.
+    Returns both images and the difference boxes found in the detail renders, in detail coordinates.
+    """
+    full_rect = (page2.rect * fitz.Matrix(detail_zoom, detail_zoom)).irect
+    size = (full_rect.width, full_rect.height)
+    detail1 = cv2.resize(screen1, size, interpolation=cv2.INTER_LINEAR)
+    detail2 = cv2.resize(screen2, size, interpolation=cv2.INTER_LINEAR)
+
+    boxes = []
+    margin = DETAIL_CLIP_MARGIN / screening_zoom
+    for x1, y1, x2, y2 in regions:
+        clip = fitz.Rect(x1 / screening_zoom - margin, y1 / screening_zoom - margin,
+                         x2 / screening_zoom + margin, y2 / screening_zoom + margin) & page2.rect
+        if clip.is_empty:
+            continue
+        clip1, (ox, oy) = render_page(page1, detail_zoom, clip)
+        clip2, _ = render_page(page2, detail_zoom, clip)
+        height = min(clip1.shape[0], size[1] - oy)
+        width = min(clip1.shape[1], size[0] - ox)
+        detail1[oy:oy + height, ox:ox + width] = clip1[:height, :width]
+        detail2[oy:oy + height, ox:ox + width] = clip2[:height, :width]
+
+        for bx1, by1, bx2, by2 in find_diff_boxes(clip1, clip2, diff_tile_map(clip1, clip2)):
+            boxes.append([bx1 + ox, by1 + oy, bx2 + ox, by2 + oy])
+
+    return detail1, detail2, boxes
+
+
+def enlarge_boxes(boxes, width, height, enlargement=5):
+    enlarged_boxes = []
+    for box in boxes:
+        x1, y1, x2, y2 = box
+        enlarged_boxes.append([
+            max(0, x1 - enlargement),
+            max(0, y1 - enlargement),
+            min(width, x2 + enlargement),
+            min(height, y2 + enlargement)
+        ])
+    return enlarged_boxes
+
+
+def draw_diff_boxes(image, boxes):
+    # Draw the bounding boxes and arrows on a copy of the image
+    image_with_boxes = image.copy()
+    for box in boxes:
+        x1, y1, x2, y2 = box
+        cv2.rectangle(image_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+
+        # Arrow properties
+        arrow_length = 150  # Adjust this value to change arrow size
+        arrow_offset = 20  # Adjust this value to change arrow distance from bounding box
+        arrow_start_x, arrow_start_y = x2 + arrow_offset + arrow_length, center_y
+        arrow_end_x, arrow_end_y = x2 + arrow_offset, center_y
+
+        # Draw arrow from right to bounding box
+        cv2.arrowedLine(image_with_boxes, (arrow_start_x, arrow_start_y), (arrow_end_x, arrow_end_y),
+                        (0, 0, 255), 4)
+    return image_with_boxes
+
+
+def compare_pdfs(pdf1_path, pdf2_path, mismatch_text=None, render_profile=None):
     try:
-        if image1.ndim == 2:
-            gray1 = image1
-        elif image1.shape[2] == 3:
-            gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-        elif image1.shape[2] == 4:
-            gray1 = cv2.cvtColor(image1, cv2.COLOR_BGRA2GRAY)
-        else:
-            logging.error(f"Invalid number of channels in input image1: {image1.shape}")
-            return 0
-
-        if image2.ndim == 2:
-            gray2 = image2
-        elif image2.shape[2] == 3:
-            gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
-        elif image2.shape[2] == 4:
-            gray2 = cv2.cvtColor(image2, cv2.COLOR_BGRA2GRAY)
-        else:
-            logging.error(f"Invalid number of channels in input image2: {image2.shape}")
-            return 0
-
-        score, _ = ssim(gray1, gray2, full=True)
-        return score
-    except Exception as e:
-        logging.error(f"Error comparing images: {e}")
-        return 0
-
+        # Byte-identical files are the common case in regression folders and need no parsing at all
+        if files_identical(pdf1_path, pdf2_path):
+            return True, True
 
-def compare_pdfs(pdf1_path, pdf2_path, mismatch_text=None):
-    try:
+        screening_zoom, detail_zoom = RENDER_PROFILES.get(render_profile or default_render_profile,
+                                                          RENDER_PROFILES['screening'])
         doc1 = fitz.open(pdf1_path)
         doc2 = fitz.open(pdf2_path)
 
@@ -77,134 +276,70 @@ def compare_pdfs(pdf1_path, pdf2_path, mismatch_text=None):
 
         text_match = True
         pixmap_match = True
+        object_digests1, object_digests2 = {}, {}
+        sources = None  # Kept copies of both PDFs for deferred artifacts
 
         for page_num in range(len(doc1)):
             page1 = doc1.load_page(page_num)
             page2 = doc2.load_page(page_num)
 
+            # Pages built from identical content render identically, so skip text and pixel checks
+            if page_fingerprint(doc1, page1, object_digests1) == page_fingerprint(doc2, page2, object_digests2):
+                continue
+
             # Get page text
             text1 = page1.get_text()
             text2 = page2.get_text()
 
             # Check text similarity
-            similarity = text_similarity(text1, text2)
-            if similarity < text_similarity_threshold:
-                text_match = False
-
-            # Increase resolution for better clarity
-            zoom_x = 2.0  # horizontal zoom
-            zoom_y = 2.0  # vertical zoom
-            mat = fitz.Matrix(zoom_x, zoom_y)
-
-            pix1 = page1.get_pixmap(matrix=mat)
-            pix2 = page2.get_pixmap(matrix=mat)
-
-            if pix1.samples != pix2.samples:
+            if text1 != text2:
+                similarity = text_similarity(text1, text2)
+                if similarity < text_similarity_threshold:
+                    text_match = False
+
+            # Screen the page at the profile's (usually lower) resolution first
+            img1, _ = render_page(page1, screening_zoom)
+            img2, _ = render_page(page2, screening_zoom)
+
+            if img1.shape != img2.shape or not np.array_equal(img1, img2):
+                # Any pixel difference is a mismatch, so no similarity score is needed to decide;
+                # the tile map only tells the bounding box stage where to look
                 pixmap_match = False
-
-                # Convert pixmap to numpy arrays
-                img1 = np.frombuffer(pix1.samples, dtype=np.uint8).reshape(pix1.h, pix1.w, pix1.n)
-                img2 = np.frombuffer(pix2.samples, dtype=np.uint8).reshape(pix2.h, pix2.w, pix2.n)
-
-                # Compare images using SSIM
-                similarity_score = compare_images(img1, img2)
-                if similarity_score < image_similarity_threshold:
-                    pixmap_match = False
-
-                # Find differences using image processing
-                diff_img = cv2.absdiff(img1, img2)
-                diff_gray = cv2.cvtColor(diff_img, cv2.COLOR_BGR2GRAY)
-                _, thresh = cv2.threshold(diff_gray, 30, 255, cv2.THRESH_BINARY)
-
-                # Find contours and draw bounding boxes around differences
-                contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-                # Find bounding boxes for all significant contours
-                bounding_boxes = []
-                size_threshold = 20
-                for contour in contours:
-                    x, y, w, h = cv2.boundingRect(contour)
-                    if w * h > size_threshold:
-                        bounding_boxes.append([x, y, x + w, y + h])
-
-                # Function to merge overlapping and adjacent bounding boxes
-                def merge_boxes(boxes, distance_threshold=30):
-                    merged = True
-                    while merged:
-                        merged = False
-                        new_boxes = []
-                        while boxes:
-                            box1 = boxes.pop(0)
-                            for i, box2 in enumerate(boxes):
-                                if (box1[0] <= box2[2] + distance_threshold and
-                                        box1[2] >= box2[0] - distance_threshold and
-                                        box1[1] <= box2[3] + distance_threshold and
-                                        box1[3] >= box2[1] - distance_threshold):
-                                    box2 = [
-                                        min(box1[0], box2[0]),
-                                        min(box1[1], box2[1]),
-                                        max(box1[2], box2[2]),
-                                        max(box1[3], box2[3])
-                                    ]
-                                    boxes[i] = box2
-                                    merged = True
-                                    break
-                            else:
-                                new_boxes.append(box1)
-                        boxes = new_boxes
-                    return boxes
+                tile_map = diff_tile_map(img1, img2)
+
+                scale = detail_zoom / screening_zoom
+                bounding_boxes = find_diff_boxes(img1, img2, tile_map, size_threshold=20 / scale ** 2)
+                if scale != 1 and page1.rotation == 0 and page2.rotation == 0:
+                    # Re-render just the differing regions at detail resolution for accurate boxes and artifacts
+                    regions = merge_boxes(bounding_boxes, distance_threshold=max(1, int(30 / scale)))
+                    img1, img2, bounding_boxes = render_diff_regions(page1, page2, img1, img2, regions,
+                                                                     screening_zoom, detail_zoom)
+                elif scale != 1:
+                    img1, _ = render_page(page1, detail_zoom)
+                    img2, _ = render_page(page2, detail_zoom)
+                    bounding_boxes = find_diff_boxes(img1, img2, diff_tile_map(img1, img2))
 
                 # Merge overlapping bounding boxes
                 merged_boxes = merge_boxes(bounding_boxes)
 
                 # Enlarge bounding boxes
-                def enlarge_boxes(boxes, enlargement=5):
-                    enlarged_boxes = []
-                    for box in boxes:
-                        x1, y1, x2, y2 = box
-                        enlarged_boxes.append([
-                            max(0, x1 - enlargement),
-                            max(0, y1 - enlargement),
-                            min(img2.shape[1], x2 + enlargement),
-                            min(img2.shape[0], y2 + enlargement)
-                        ])
-                    return enlarged_boxes
-
-                enlarged_boxes = enlarge_boxes(merged_boxes)
+                enlarged_boxes = enlarge_boxes(merged_boxes, img2.shape[1], img2.shape[0])
+
+                if artifact_mode == 'lazy':
+                    # Only keep what is needed to draw the images when a reviewer opens them
+                    if sources is None:
+                        # Hashed and copied once per pair, however many pages differ
+                        sources = deferred_artifacts.keep_source(pdf1_path), deferred_artifacts.keep_source(pdf2_path)
+                    deferred_artifacts.record(pdf1_path, pdf2_path, *sources, page_num, enlarged_boxes, detail_zoom)
+                    continue
 
                 # Draw the enlarged bounding boxes and arrows on the image
-                img2_with_boxes = img2.copy()
-                for box in enlarged_boxes:
-                    x1, y1, x2, y2 = box
-                    cv2.rectangle(img2_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
-
-                    # Arrow properties
-                    arrow_length = 150  # Adjust this value to change arrow size
-                    arrow_offset = 20  # Adjust this value to change arrow distance from bounding box
-                    arrow_start_x, arrow_start_y = x2 + arrow_offset + arrow_length, center_y
-                    arrow_end_x, arrow_end_y = x2 + arrow_offset, center_y
-
-                    # Draw arrow from right to bounding box
-                    cv2.arrowedLine(img2_with_boxes, (arrow_start_x, arrow_start_y), (arrow_end_x, arrow_end_y),
-                                    (0, 0, 255), 4)
-
-                # Save the original image
-                original_dir = 'static/manual_compare_img/original'
-                if not os.path.exists(original_dir):
-                    os.makedirs(original_dir)
-                original_path = os.path.join(original_dir,
-                                             os.path.splitext(os.path.basename(pdf1_path))[
-                                                 0] + f'_Page_{page_num + 1}.png')
-                cv2.imwrite(original_path, img1)
-
-                # Save the image with bounding boxes
-                screenshot_dir = 'static/manual_compare_img/bounding_screenshot'
-                if not os.path.exists(screenshot_dir):
-                    os.makedirs(screenshot_dir)
-                screenshot_path = os.path.join(screenshot_dir, os.path.splitext(os.path.basename(pdf2_path))[
-                    0] + f'_Page_{page_num + 1}.png')
-                cv2.imwrite(screenshot_path, img2_with_boxes)
+                img2_with_boxes = draw_diff_boxes(img2, enlarged_boxes)
+
+                # Save the original image and the image with bounding boxes in the background
+                artifact_writer.write(os.path.join(BASELINE_IMG_FOLDER, artifact_writer.filename(pdf1_path, page_num)), img1)
+                artifact_writer.write(os.path.join(CHANGED_IMG_FOLDER, artifact_writer.filename(pdf2_path, page_num)),
+                                      img2_with_boxes)
 
         return text_match, pixmap_match
     except Exception as e:
@@ -212,10 +347,46 @@ def compare_pdfs(pdf1_path, pdf2_path, mismatch_text=None):
         return False, False
 
 
-def compare_single_file_pair(args):
+def _render_artifact_image(artifact_id, kind):
+    artifact = deferred_artifacts.get(artifact_id)
+    if artifact is None:
+        return None
+    pdf_path = artifact['pdf1_source'] if kind == 'original' else artifact['pdf2_source']
+    with fitz.open(pdf_path) as doc:
+        image, _ = render_page(doc.load_page(artifact['page_num']), artifact['detail_zoom'])
+    if kind == 'bounding_box':
+        image = draw_diff_boxes(image, artifact['boxes'])
+    return artifact_writer.encode(image)
+
+
+# Most recently viewed diff images, encoded. The cache belongs to one process: clearing artifacts elsewhere doesn't
+# reach it, so render_artifact_image checks the artifact still exists before using it. Ids are never reused,
+# so the image cached for an existing id is always the right one.
+_cached_artifact_image = functools.lru_cache(maxsize=artifact_cache_size)(_render_artifact_image)
+
+
+def render_artifact_image(artifact_id, kind):
+    """
+    Render one recorded diff image on demand: kind 'original' is the baseline page,
+    'bounding_box' the changed page with its diff boxes. Returns the encoded image, or None if the id is unknown.
+    """
+    if kind not in ('original', 'bounding_box') or deferred_artifacts.get(artifact_id) is None:
+        return None
+    return _cached_artifact_image(artifact_id, kind)
+
+
+def clear_deferred_artifacts():
+    deferred_artifacts.clear()
+    # Only frees this process's memory; other processes stop serving the images through the existence check
+    _cached_artifact_image.cache_clear()
+
+
+def compare_single_file_pair(args, render_profile=None):
     file1, file2, mismatch_dir, match_dir = args
     try:
-        text_match, pixmap_match = compare_pdfs(file1, file2)
+        text_match, pixmap_match = compare_pdfs(file1, file2, render_profile=render_profile)
+        if flush_artifacts_per_pair:
+            artifact_writer.flush()
         if text_match and pixmap_match:
             match_path = os.path.join(match_dir, os.path.basename(file1))
             if not os.path.exists(match_path):  # Avoid redundant writes
@@ -231,69 +402,103 @@ def compare_single_file_pair(args):
         return "error", os.path.basename(file1)
 
 
-def compare_pdf_folders_in_parallel(folder1, folder2, mismatch_dir, match_dir):
-    mismatches = []
-    matches = []
-    errors = []
+def find_file_pairs(folder1, folder2, mismatch_dir, match_dir):
     folder2_files = {os.path.basename(file): os.path.join(root, file) for root, _, files in os.walk(folder2) for file in
                      files if file.endswith('.pdf')}
-    file_pairs = [(os.path.join(root, file), folder2_files[file], mismatch_dir, match_dir) for root, _, files in
-                  os.walk(folder1) for file in files if file.endswith('.pdf') and file in folder2_files]
+    folder1_count = 0
 
-    # Log if files are found or not in folders
-    folder1_files = [os.path.join(root, file) for root, _, files in os.walk(folder1) for file in files if
-                     file.endswith('.pdf')]
-    folder2_files_check = [os.path.join(root, file) for root, _, files in os.walk(folder2) for file in files if
-                           file.endswith('.pdf')]
+    for root, _, files in os.walk(folder1):
+        for file in files:
+            if not file.endswith('.pdf'):
+                continue
+            folder1_count += 1
+            if file in folder2_files:
+                yield os.path.join(root, file), folder2_files[file], mismatch_dir, match_dir
+            else:
+                logging.warning(f"File {file} from folder1 not found in folder2.")
 
-    if not folder1_files:
+    if not folder1_count:
         logging.warning("No files found in folder1.")
     else:
-        logging.info(f"Found {len(folder1_files)} files in folder1.")
+        logging.info(f"Found {folder1_count} files in folder1.")
 
-    if not folder2_files_check:
+    if not folder2_files:
         logging.warning("No files found in folder2.")
     else:
-        logging.info(f"Found {len(folder2_files_check)} files in folder2.")
+        logging.info(f"Found {len(folder2_files)} files in folder2.")
 
-    # Log which files were not found in the second folder
-    for root, _, files in os.walk(folder1):
-        for file in files:
-            if file.endswith('.pdf') and file not in folder2_files:
-                logging.warning(f"File {file} from folder1 not found in folder2.")
+
+def file_pair_size(file_pair):
+    try:
+        return max(os.path.getsize(file_pair[0]), os.path.getsize(file_pair[1]))
+    except OSError:
+        return 0
+
+
+def iter_compare_pdf_folders(folder1, folder2, mismatch_dir, match_dir, mode=None, render_profile=None):
+    """
+    Compare every pair of same-named PDFs and yield (result, file) as soon as each pair finishes.
+    Largest documents are started first and the workers are refilled as soon as any pair completes,
+    so one long file no longer holds up a whole batch.
+    `mode` selects thread or process workers and defaults to ExecutionMode from data/config.ini,
+    `render_profile` picks an entry of RENDER_PROFILES and defaults to RenderProfile.
+    """
+    file_pairs = sorted(find_file_pairs(folder1, folder2, mismatch_dir, match_dir), key=file_pair_size, reverse=True)
 
     if not file_pairs:
         logging.warning("No matching files found in folder1 or folder2.")
-    else:
-        logging.info(f"Found {len(file_pairs)} matching files to compare.")
-
-    for i in range(0, len(file_pairs), batch_size):
-        batch = file_pairs[i:i + batch_size]
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file_pair = {executor.submit(compare_single_file_pair, file_pair): file_pair for file_pair in
-                                   batch}
-            for future in as_completed(future_to_file_pair):
+        return
+    logging.info(f"Found {len(file_pairs)} matching files to compare.")
+
+    pending_pairs = iter(file_pairs)
+    max_in_flight = max_workers * 2  # Keep the next pairs queued so a worker never waits on the scheduler
+
+    with create_compare_executor(mode) as executor:
+        in_flight = {}
+        for file_pair in itertools.islice(pending_pairs, max_in_flight):
+            in_flight[executor.submit(compare_single_file_pair, file_pair, render_profile)] = file_pair
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_pair = in_flight.pop(future)
+                for next_pair in itertools.islice(pending_pairs, 1):
+                    in_flight[executor.submit(compare_single_file_pair, next_pair, render_profile)] = next_pair
                 try:
-                    result, file = future.result()
-                    if result == "match":
-                        matches.append({
-                            "title": "Matched File",
-                            "message": file,
-                            "download_link": file
-                        })
-                    elif result == "mismatch":
-                        mismatches.append({
-                            "title": "Mismatched File",
-                            "message": file,
-                            "download_link": file
-                        })
-                    else:
-                        errors.append({
-                            "title": "Error File",
-                            "message": file,
-                            "download_link": file
-                        })
+                    yield future.result()
                 except Exception as e:
-                    logging.error(f"Error processing future result: {future_to_file_pair[future]} - {e}")
+                    logging.error(f"Error processing future result: {file_pair} - {e}")
+
+    # Diff images of the last pairs may still be encoding
+    artifact_writer.flush()
+
+
+def compare_pdf_folders_in_parallel(folder1, folder2, mismatch_dir, match_dir, on_result=None, mode=None,
+                                    render_profile=None):
+    mismatches = []
+    matches = []
+    errors = []
+
+    for result, file in iter_compare_pdf_folders(folder1, folder2, mismatch_dir, match_dir, mode, render_profile):
+        if result == "match":
+            matches.append({
+                "title": "Matched File",
+                "message": file,
+                "download_link": file
+            })
+        elif result == "mismatch":
+            mismatches.append({
+                "title": "Mismatched File",
+                "message": file,
+                "download_link": file
+            })
+        else:
+            errors.append({
+                "title": "Error File",
+                "message": file,
+                "download_link": file
+            })
+        if on_result:
+            on_result(result, file, len(matches) + len(mismatches) + len(errors))
 
     return {"matches": matches, "mismatches": mismatches, "errors": errors}
@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+
+def boxes_near(box1, box2, distance_threshold):
+    return (box1[0] <= box2[2] + distance_threshold and
+            box1[2] >= box2[0] - distance_threshold and
+            box1[1] <= box2[3] + distance_threshold and
+            box1[3] >= box2[1] - distance_threshold)
+
+
+def _merge_pass(boxes, distance_threshold, cell_size):
+    # Union-find over boxes, with a uniform grid so each box is only tested against boxes in nearby cells
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    grid = defaultdict(list)
+    for i, box in enumerate(boxes):
+        cells = [(cx, cy)
+                 for cx in range((box[0] - distance_threshold) // cell_size, (box[2] + distance_threshold) // cell_size + 1)
+                 for cy in range((box[1] - distance_threshold) // cell_size, (box[3] + distance_threshold) // cell_size + 1)]
+        for cell in cells:
+            for j in grid[cell]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j and boxes_near(box, boxes[j], distance_threshold):
+                    parent[root_j] = root_i
+            grid[cell].append(i)
+
+    merged = {}
+    for i, box in enumerate(boxes):
+        root = find(i)
+        if root in merged:
+            current = merged[root]
+            merged[root] = [min(current[0], box[0]), min(current[1], box[1]),
+                            max(current[2], box[2]), max(current[3], box[3])]
+        else:
+            merged[root] = list(box)
+    return list(merged.values())
+
+
+def merge_boxes(boxes, distance_threshold=30, cell_size=None):
+    """
+    Merge [x1, y1, x2, y2] boxes that overlap or lie within distance_threshold of each other, repeating on the
+    merged boxes until none are near any other. Produces the same boxes as pairwise merging until nothing changes,
+    but each pass is near-linear instead of rescanning every remaining box.
+    """
+    cell_size = cell_size or max(64, 2 * distance_threshold)
+    boxes = [list(box) for box in boxes]
+    while True:
+        merged = _merge_pass(boxes, distance_threshold, cell_size)
+        if len(merged) == len(boxes):
+            return merged
+        boxes = merged
@@ -0,0 +1,116 @@
+import contextlib
+import glob
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle
+
+from config import REPORT_CACHE_FOLDER
+from src.output_index import output_index
+
+ROWS_PER_PAGE = 35
+HEADER = ["Number", "File Name", "Date Processed", "Signatures"]
+COLUMN_WIDTHS = [0.7 * inch, 4.5 * inch, 1.5 * inch, 1 * inch]
+
+TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),  # Header background color
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),  # Header text color
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),  # Center align all cells
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),  # Header font
+    ("FONTSIZE", (0, 0), (-1, 0), 12),  # Header font size
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 12),  # Header bottom padding
+    ("BACKGROUND", (0, 1), (-1, -1), colors.beige),  # Alternate row background color
+    ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),  # Alternate row text color
+    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),  # Cell font
+    ("FONTSIZE", (0, 1), (-1, -1), 10),  # Cell font size
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),  # Center align all cells vertically
+    ("GRID", (0, 0), (-1, -1), 1, colors.black),  # Add grid lines
+    ("ALIGN", (1, 1), (1, -1), "LEFT"),  # Left align the "File Name" column
+])
+
+
+def _draw_page(c, table_data):
+    width, height = letter
+    table = Table(table_data, colWidths=COLUMN_WIDTHS)
+    table.setStyle(TABLE_STYLE)
+    table.wrapOn(c, width, height)
+    table.drawOn(c, 30, height - 65 - table._height)
+
+    c.setFont("Helvetica-Bold", 24)
+    c.setFillColorRGB(0, 0, 0.5)  # Dark blue color
+    c.drawString(30, height - 40, "Processed Files Report")
+    c.showPage()
+
+
+def write_processed_files_report(rows, output_filepath):
+    """
+    Write the processed files report for (filename, processed_at, signatures) rows to output_filepath,
+    one table of ROWS_PER_PAGE rows per page. Rows are consumed as they come, so they can be read straight from the index.
+    """
+    c = canvas.Canvas(output_filepath, pagesize=letter)
+    table_data = [HEADER]
+    for idx, (filename, processed_at, signatures) in enumerate(rows, start=1):
+        # Shorten long file names so they fit the column
+        file_name = filename[:58] + "..." if len(filename) > 58 else filename
+        processed_time = datetime.fromtimestamp(processed_at).strftime("%Y-%m-%d %H:%M:%S")
+        table_data.append([str(idx), file_name, processed_time, str(signatures)])
+
+        if len(table_data) > ROWS_PER_PAGE:
+            _draw_page(c, table_data)
+            table_data = [HEADER]
+
+    if len(table_data) > 1:
+        _draw_page(c, table_data)
+    c.save()
+
+
+class ReportCache:
+    """
+    Processed files reports built from the output index and kept on disk, one per index generation.
+    A report is rebuilt only after outputs were recorded or removed; until then every export serves the same file.
+    """
+
+    def __init__(self, cache_folder, index):
+        self.cache_folder = cache_folder
+        self.index = index
+        self._lock = threading.Lock()
+
+    def report_path(self, generation):
+        return os.path.join(self.cache_folder, f'processed_files_{generation}.pdf')
+
+    def get(self):
+        """Path and generation of the report for the current outputs, building it if needed."""
+        generation = self.index.generation()
+        report_path = self.report_path(generation)
+        if os.path.exists(report_path):
+            return report_path, generation
+
+        with self._lock:
+            if os.path.exists(report_path):
+                return report_path, generation
+            os.makedirs(self.cache_folder, exist_ok=True)
+            temp_report_path = os.path.join(self.cache_folder, f'.{uuid.uuid4().hex}.tmp')
+            try:
+                write_processed_files_report(self.index.iter_all(), temp_report_path)
+                os.replace(temp_report_path, report_path)
+            finally:
+                if os.path.exists(temp_report_path):
+                    os.remove(temp_report_path)
+            logging.info(f"Built processed files report for output generation {generation}")
+
+            # Reports of older generations are stale; one still being downloaded stays readable until it is closed
+            for stale_path in glob.glob(os.path.join(self.cache_folder, 'processed_files_*.pdf')):
+                if stale_path != report_path:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(stale_path)
+        return report_path, generation
+
+
+report_cache = ReportCache(REPORT_CACHE_FOLDER, output_index)
@@ -1,24 +1,48 @@
+import bisect
 import json
 import re
 import logging
-from PyPDF2 import PdfReader, PdfWriter
-from pytesseract import image_to_string
-from pdf2image import convert_from_path
+from concurrent.futures import ThreadPoolExecutor
 import aiofiles
 import os
+import uuid
 from asyncio import Lock
+from config import OCR_DPI, OCR_MAX_WORKERS, PDF_BACKEND, DETECTION_SIGNATURE_WIDGETS, DETECTION_LAST_N_PAGES, \
+    DETECTION_PAGE_RANGE, DETECTION_MAX_SIGNATURES
+from src.ocr import ocr_image
+from src.keyword_matcher import KeywordMatcher
+from src.pdf_backends import open_pdf
+
+def parse_page_range(page_range):
+    """Parse a 1-based inclusive page range like '2-5' or '3' into (first, last), or None when empty."""
+    if not page_range:
+        return None
+    first, _, last = page_range.partition('-')
+    return int(first), int(last or first)
 
 class SignatureDetector:
-    def __init__(self):
+    def __init__(self, backend=PDF_BACKEND, use_signature_widgets=DETECTION_SIGNATURE_WIDGETS,
+                 last_n_pages=DETECTION_LAST_N_PAGES, page_range=DETECTION_PAGE_RANGE, max_signatures=DETECTION_MAX_SIGNATURES):
+        self.backend = backend  # Name of the PDF backend documents are opened with, see src/pdf_backends.py
+        # Detection strategy: which pages are scanned and when scanning stops
+        self.use_signature_widgets = use_signature_widgets
+        self.last_n_pages = last_n_pages
+        self.page_range = parse_page_range(page_range)
+        self.max_signatures = max_signatures
         self.primary_keywords = []
         self.secondary_keywords = []
+        self.keyword_matcher = KeywordMatcher([], [])
         self.load_default_keywords()
         self.lock = Lock()  # Ensure thread-safe operations
 
     async def set_keywords(self, primary_keywords, secondary_keywords=None):
         async with self.lock:
-            self.primary_keywords = primary_keywords
-            self.secondary_keywords = secondary_keywords if secondary_keywords is not None else []
+            self.apply_keywords(primary_keywords, secondary_keywords)
+
+    def apply_keywords(self, primary_keywords, secondary_keywords=None):
+        self.primary_keywords = primary_keywords
+        self.secondary_keywords = secondary_keywords if secondary_keywords is not None else []
+        self.compile_keywords()
 
     def load_default_keywords(self):
         self.set_keywords_from_json('data/defaultKeywords.json')
@@ -26,8 +50,13 @@ class SignatureDetector:
     def set_keywords_from_json(self, json_path):
         with open(json_path, 'r') as file:
             data = json.load(file)
-        self.primary_keywords = data.get('primary_keywords', [])
-        self.secondary_keywords = data.get('secondary_keywords', [])
+        self.apply_keywords(data.get('primary_keywords', []), data.get('secondary_keywords', []))
+
+    def compile_keywords(self):
+        # Build the matcher once per keyword change instead of on every page
+        self.keyword_matcher = KeywordMatcher(self.primary_keywords, self.secondary_keywords)
+        self._primary_keyword_patterns = [re.compile(re.escape(keyword)) for keyword in self.primary_keywords]
+        self._secondary_keyword_patterns = [re.compile(re.escape(keyword)) for keyword in self.secondary_keywords]
 
     async def save_keywords_to_json(self, json_path, primary_keywords, secondary_keywords):
         async with aiofiles.open(json_path, 'w') as file:
@@ -38,53 +67,143 @@ class SignatureDetector:
 
     @property
     def primary_keyword_patterns(self):
-        return [re.compile(re.escape(keyword)) for keyword in self.primary_keywords]
+        return self._primary_keyword_patterns
 
     @property
     def secondary_keyword_patterns(self):
-        return [re.compile(re.escape(keyword)) for keyword in self.secondary_keywords]
+        return self._secondary_keyword_patterns
 
-    async def detect_signature_pages(self, pdf_reader, pdf_path):
+    def open_document(self, pdf_path):
+        """Open a PDF once for detection, OCR and extraction."""
+        return open_pdf(pdf_path, self.backend)
+
+    async def detect_signature_pages(self, document):
+        return self.detect_signature_pages_sync(document)
+
+    @property
+    def detection_fingerprint(self):
+        """Identifies everything detection results depend on: keywords, PDF backend and strategy."""
+        return (f'{self.keyword_matcher.fingerprint}:{self.backend}:{int(self.use_signature_widgets)}:'
+                f'{self.last_n_pages}:{self.page_range}:{self.max_signatures}')
+
+    def page_scope(self, page_count):
+        if self.last_n_pages:
+            return range(max(0, page_count - self.last_n_pages), page_count)
+        if self.page_range:
+            first, last = self.page_range
+            return range(max(0, first - 1), min(page_count, last))
+        return range(page_count)
+
+    def detect_signature_pages_sync(self, document, page_nums=None):
+        """
+        Signature pages of the document; page_nums limits the scan to those pages (a shard of a large document).
+        With max_signatures set, the result is the first max_signatures signature pages in page order, however they
+        were found, so a document gives the same pages whether it is scanned whole or in shards.
+        Pages with a signature form field count without a text check, so the secondary keyword exclusion doesn't apply to them.
+        """
         signature_pages = []
+        ocr_page_nums = []
+        keyword_matcher = self.keyword_matcher
+        scope = self.page_scope(document.page_count)
+        if page_nums is not None:
+            scope = [page_num for page_num in page_nums if page_num in scope]
+        max_signatures = self.max_signatures
+
+        widget_pages = set()
+        if self.use_signature_widgets:
+            # Signature form fields are found from the document structure, so those pages skip the text pass
+            try:
+                widget_pages = set(document.signature_widget_pages()).intersection(scope)
+            except Exception as e:
+                logging.error(f"Error reading signature fields in PDF: {e}")
 
-        for page_num in range(len(pdf_reader.pages)):
+        for page_num in scope:
+            # Pages after the first max_signatures matches can't be among them, whatever OCR finds before them
+            if max_signatures and len(signature_pages) >= max_signatures:
+                break
+            if page_num in widget_pages:
+                signature_pages.append(page_num)
+                continue
             try:
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
+                text = document.page_text(page_num)
                 if text:
                     text = text.strip()
-                    primary_keyword_matched = any(pattern.search(text) for pattern in self.primary_keyword_patterns)
-                    if primary_keyword_matched:
-                        secondary_keyword_matched = any(secondary_keyword.lower() in text.lower() for secondary_keyword in self.secondary_keywords)
-                        if not secondary_keyword_matched:
-                            signature_pages.append(page_num)
+                    if keyword_matcher.is_signature_page(text):
+                        signature_pages.append(page_num)
                 else:
-                    images = convert_from_path(pdf_path, first_page=page_num + 1, last_page=page_num + 1)
-                    for image in images:
-                        ocr_text = image_to_string(image).strip()
-                        primary_keyword_matched = any(pattern.search(ocr_text) for pattern in self.primary_keyword_patterns)
-                        if primary_keyword_matched:
-                            secondary_keyword_matched = any(secondary_keyword.lower() in ocr_text.lower() for secondary_keyword in self.secondary_keywords)
-                            if not secondary_keyword_matched:
-                                signature_pages.append(page_num)
+                    # Pages without a text layer are OCRed together once the text pass is done
+                    ocr_page_nums.append(page_num)
             except Exception as e:
                 logging.error(f"Error processing page {page_num} in PDF: {e}")
 
-        return signature_pages
+        if ocr_page_nums:
+            found_pages = list(signature_pages)  # Sorted, since the text pass runs in page order
+            ocr_matches = 0
+            # OCR results arrive in page order, so OCR stops once max_signatures matches come before the next page
+            for page_num, ocr_text in self.ocr_pages(document, ocr_page_nums):
+                if max_signatures and bisect.bisect_left(found_pages, page_num) + ocr_matches >= max_signatures:
+                    break
+                if keyword_matcher.is_signature_page(ocr_text):
+                    signature_pages.append(page_num)
+                    ocr_matches += 1
 
-    async def extract_signature_pages(self, reader, page_nums, output_filepath):
-        writer = PdfWriter()
-        for page_num in page_nums:
-            writer.add_page(reader.pages[page_num])
+        signature_pages.sort()
+        return signature_pages[:max_signatures or None]
 
-        temp_output_filepath = output_filepath + '.tmp'
+    def ocr_pages(self, document, page_nums):
+        """
+        Rasterize the given pages from the open document and OCR them on a bounded thread pool.
+        Yields (page_num, text) for every page that was OCRed successfully.
+        """
+        max_pending = OCR_MAX_WORKERS * 2  # Bounds how many rendered pages are held in memory
+
+        def ocr_page(page_num, image):
+            try:
+                return page_num, ocr_image(image).strip()
+            except Exception as e:
+                logging.error(f"Error processing page {page_num} in PDF: {e}")
+                return page_num, None
+
+        with ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS) as executor:
+            pending = []
+            try:
+                for page_num in page_nums:
+                    try:
+                        image = document.render_page(page_num, OCR_DPI)
+                    except Exception as e:
+                        logging.error(f"Error processing page {page_num} in PDF: {e}")
+                        continue
+
+                    pending.append(executor.submit(ocr_page, page_num, image))
+                    if len(pending) >= max_pending:
+                        # Results are yielded in page order as they finish, so a caller can stop early
+                        done_page_num, text = pending.pop(0).result()
+                        if text is not None:
+                            yield done_page_num, text
+
+                while pending:
+                    done_page_num, text = pending.pop(0).result()
+                    if text is not None:
+                        yield done_page_num, text
+            finally:
+                # Pages not started yet when the caller stopped early are dropped
+                for future in pending:
+                    future.cancel()
+
+    def extract_signature_pages_sync(self, document, page_nums, output_filepath):
+        """
+        Write the pages straight to a temp file next to output_filepath and rename it into place,
+        so every output is written once and readers never see a partial file.
+        """
+        temp_output_filepath = os.path.join(os.path.dirname(os.path.abspath(output_filepath)), f'.{uuid.uuid4().hex}.tmp')
         try:
-            with open(temp_output_filepath, 'wb') as output_pdf:
-                writer.write(output_pdf)
-            async with aiofiles.open(temp_output_filepath, 'rb') as temp_output_pdf, aiofiles.open(output_filepath, 'wb') as final_output_pdf:
-                await final_output_pdf.write(await temp_output_pdf.read())
+            document.extract_pages(page_nums, temp_output_filepath)
+            os.replace(temp_output_filepath, output_filepath)
         finally:
             if os.path.exists(temp_output_filepath):
                 os.remove(temp_output_filepath)
 
+    async def extract_signature_pages(self, document, page_nums, output_filepath):
+        self.extract_signature_pages_sync(document, page_nums, output_filepath)
+
 signature_detector = SignatureDetector()
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Base of the stores kept in SQLite (caches, job queue, artifacts, output index, upload sessions).
+    The database is shared by every thread and process, so each call opens its own connection; the first one in a
+    process creates the folder, switches the database to WAL and sets up the schema from `_create_schema`.
+    Stores that manage their own transactions (BEGIN IMMEDIATE) set `isolation_level = None`.
+    """
+
+    isolation_level = ''  # sqlite3's default: transactions are opened implicitly
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._initialized_pid = None
+        self._init_lock = threading.Lock()
+
+    def _create_schema(self, conn):
+        raise NotImplementedError
+
+    def _open(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=self.isolation_level)
+
+    def _connect(self):
+        if self._initialized_pid == os.getpid():
+            return self._open()
+
+        with self._init_lock:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = self._open()
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._create_schema(conn)
+            conn.commit()
+            self._initialized_pid = os.getpid()
+        return conn
@@ -0,0 +1,148 @@
+import bisect
+import re
+from difflib import SequenceMatcher
+
+TOKEN_PATTERN = re.compile(r'\S+')
+PARTIAL_MATCH_MAX_CHARS = 200
+SHINGLE_TOKENS = 8  # Words per anchor; long enough to be unique even on pages written with a handful of words
+RESYNC_WINDOW = 16  # Words looked ahead to get past an edit where no anchor is left
+
+
+def sequence_similarity(text1, text2):
+    """Character-level SequenceMatcher ratio, the original measure. Quadratic in the worst case."""
+    return SequenceMatcher(None, text1, text2).ratio()
+
+
+def _token_chars(tokens):
+    # Every token counts with the one separator in front of it, like the spaces SequenceMatcher sees between words
+    return sum(len(token) + 1 for token in tokens)
+
+
+def _anchors(tokens1, tokens2, shingle_tokens):
+    """
+    (i, j) positions of the runs of shingle_tokens words that occur exactly once in both texts, keeping the longest
+    chain that is in order in both (patience diff), so the anchors can't cross.
+    """
+    positions = []
+    for tokens in (tokens1, tokens2):
+        shingles = {}
+        for i in range(len(tokens) - shingle_tokens + 1):
+            shingle = tuple(tokens[i:i + shingle_tokens])
+            shingles[shingle] = None if shingle in shingles else i
+        positions.append(shingles)
+    shingles1, shingles2 = positions
+    pairs = [(i, shingles2[shingle]) for shingle, i in shingles1.items()
+             if i is not None and shingles2.get(shingle) is not None]
+
+    # Longest increasing subsequence of j, with pairs already ordered by i
+    tails, tail_indexes, previous = [], [], []
+    for index, (_, j) in enumerate(pairs):
+        length = bisect.bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[length] = j
+            tail_indexes[length] = index
+        previous.append(tail_indexes[length - 1] if length else None)
+
+    chain = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        chain.append(pairs[index])
+        index = previous[index]
+    return chain[::-1]
+
+
+def _resync_matched(tokens1, tokens2):
+    """Characters matched walking both texts in step and skipping at most RESYNC_WINDOW words to get back in line."""
+    matched = i = j = 0
+    while i < len(tokens1) and j < len(tokens2):
+        if tokens1[i] == tokens2[j]:
+            matched += len(tokens1[i]) + 1
+            i += 1
+            j += 1
+            continue
+        for skip in range(1, RESYNC_WINDOW + 1):
+            if i + skip < len(tokens1) and tokens1[i + skip] == tokens2[j]:
+                i += skip
+                break
+            if j + skip < len(tokens2) and tokens1[i] == tokens2[j + skip]:
+                j += skip
+                break
+        else:
+            i += 1
+            j += 1
+    return matched
+
+
+def _matched_chars(tokens1, tokens2, shingle_tokens=SHINGLE_TOKENS):
+    """Characters two token lists have in common, aligning them on ever shorter anchors."""
+    prefix = 0
+    limit = min(len(tokens1), len(tokens2))
+    while prefix < limit and tokens1[prefix] == tokens2[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and tokens1[-1 - suffix] == tokens2[-1 - suffix]:
+        suffix += 1
+    matched = _token_chars(tokens1[:prefix]) + _token_chars(tokens1[len(tokens1) - suffix:])
+    tokens1 = tokens1[prefix:len(tokens1) - suffix]
+    tokens2 = tokens2[prefix:len(tokens2) - suffix]
+    if not tokens1 or not tokens2:
+        return matched
+
+    segment1 = ' '.join(tokens1)
+    segment2 = ' '.join(tokens2)
+    if len(segment1) <= PARTIAL_MATCH_MAX_CHARS and len(segment2) <= PARTIAL_MATCH_MAX_CHARS:
+        # Short replaced stretches are compared character by character, so a changed word keeps credit for the characters it kept
+        blocks = SequenceMatcher(None, segment1, segment2, autojunk=False).get_matching_blocks()
+        return matched + sum(block.size for block in blocks) + 1  # + the separator in front of the stretch
+
+    if not shingle_tokens:
+        return matched + _resync_matched(tokens1, tokens2)
+
+    anchors = _anchors(tokens1, tokens2, shingle_tokens)
+    end1 = end2 = 0
+    for i, j in anchors:
+        if i < end1 or j < end2:
+            # Already covered by the run grown from the previous anchor
+            continue
+        start1, start2 = i, j
+        while start1 > end1 and start2 > end2 and tokens1[start1 - 1] == tokens2[start2 - 1]:
+            start1 -= 1
+            start2 -= 1
+        matched += _matched_chars(tokens1[end1:start1], tokens2[end2:start2], shingle_tokens // 2)
+        end1, end2 = i, j
+        while end1 < len(tokens1) and end2 < len(tokens2) and tokens1[end1] == tokens2[end2]:
+            end1 += 1
+            end2 += 1
+        matched += _token_chars(tokens1[start1:end1])
+    return matched + _matched_chars(tokens1[end1:], tokens2[end2:], shingle_tokens // 2)
+
+
+def fast_similarity(text1, text2):
+    """
+    Similarity on the same scale as sequence_similarity, computed from a word-level diff in near-linear time.
+    The texts are aligned on runs of words that occur once in each (anchors), then the stretches between anchors
+    on shorter runs, down to single words; stretches left without anchors are walked in step. Short replaced
+    stretches are compared character by character, so a changed word still gets credit for the characters it kept.
+    Returns 2 * matched characters / total characters with runs of whitespace counted as one character, which is
+    the character ratio SequenceMatcher gives without its autojunk heuristic. sequence_similarity keeps autojunk,
+    which makes it drop sharply on long pages, so the two engines can disagree on long, nearly identical pages.
+    """
+    if text1 == text2:
+        return 1.0
+
+    tokens1 = TOKEN_PATTERN.findall(text1)
+    tokens2 = TOKEN_PATTERN.findall(text2)
+    total = _token_chars(tokens1) + _token_chars(tokens2)
+    if total == 0:
+        # Only whitespace differs
+        return 1.0
+    return 2.0 * _matched_chars(tokens1, tokens2) / total
+
+
+SIMILARITY_ENGINES = {
+    'fast': fast_similarity,
+    'sequence': sequence_similarity
+}
@@ -1,14 +1,20 @@
 import os
+import hashlib
 import logging
 import shutil
-import aiofiles
+import threading
 import asyncio
+import fitz  # PyMuPDF
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from flask import Flask, request, jsonify, render_template
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader
-from config import UPLOAD_FOLDER, OUTPUT_FOLDER, ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH, BATCH_SIZE
+from config import UPLOAD_FOLDER, OUTPUT_FOLDER, ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH, BATCH_SIZE, JOB_WORKERS, FILES_PER_TASK, \
+    SAVE_BLOCK_SIZE, SAVE_MAX_BYTES_IN_FLIGHT, SHARD_MIN_BYTES, SHARD_MIN_PAGES, SHARD_PAGES
 from src.signature_detection import signature_detector
+from src.cache import detection_cache
+from src.output_index import output_index
+from src.jobs import job_queue, new_job_id, JobWorkerPool
+from src.utils import file_sha256
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -18,43 +24,213 @@ app.config['BATCH_SIZE'] = BATCH_SIZE  # Declare batch size
 
 logging.basicConfig(level=logging.DEBUG)
 
+def init_detection_worker(primary_keywords, secondary_keywords):
+    # Runs once per worker process, so keywords are set up once instead of per file
+    signature_detector.apply_keywords(primary_keywords, secondary_keywords)
+
+def use_keywords(keywords):
+    # Jobs carry the keywords they were queued with, so workers in any process detect with what the UI showed
+    if keywords is None:
+        return
+    primary_keywords, secondary_keywords = keywords
+    if (primary_keywords, secondary_keywords) != (signature_detector.primary_keywords, signature_detector.secondary_keywords):
+        signature_detector.apply_keywords(primary_keywords, secondary_keywords)
+
+def current_keywords():
+    return signature_detector.primary_keywords, signature_detector.secondary_keywords
+
+def detection_cache_key(content_hash):
+    return f'{content_hash}:{signature_detector.detection_fingerprint}'
+
 # Using ProcessPoolExecutor for CPU-bound tasks
-process_executor = ProcessPoolExecutor(max_workers=os.cpu_count()*2)
+process_executor = ProcessPoolExecutor(max_workers=os.cpu_count()*2, initializer=init_detection_worker,
+                                       initargs=current_keywords())
 # Using ThreadPoolExecutor for I/O-bound tasks
 io_executor = ThreadPoolExecutor(max_workers=os.cpu_count() * 3)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Each slot is one block being copied; together they cap the upload bytes held in memory across all concurrent saves
+save_slots = threading.BoundedSemaphore(max(1, SAVE_MAX_BYTES_IN_FLIGHT // SAVE_BLOCK_SIZE))
+
+def save_stream_sync(stream, filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'wb') as f:
+        while True:
+            with save_slots:
+                block = stream.read(SAVE_BLOCK_SIZE)
+                if not block:
+                    break
+                sha256.update(block)
+                f.write(block)
+    return sha256.hexdigest()
+
 async def save_file(file, upload_folder, filename=None):
+    """Copy an uploaded file to disk block by block; returns its path and the sha256 of its content."""
     if not filename:
         filename = secure_filename(file.filename)
     filepath = os.path.join(upload_folder, filename)
-    async with aiofiles.open(filepath, 'wb') as f:
-        await f.write(file.read())
+    content_hash = await asyncio.get_running_loop().run_in_executor(io_executor, save_stream_sync, file.stream, filepath)
     logging.debug(f"Saved file {filename} to {filepath}")
-    return filepath
+    return filepath, content_hash
+
+def process_files_sync(filepaths, content_hashes=None, keywords=None):
+    use_keywords(keywords)
+    content_hashes = content_hashes or [None] * len(filepaths)
+    return [process_file_sync(filepath, content_hash) for filepath, content_hash in zip(filepaths, content_hashes)]
+
+def detect_pages_sync(filepath, page_nums, keywords=None):
+    use_keywords(keywords)
+    with signature_detector.open_document(filepath) as document:
+        return signature_detector.detect_signature_pages_sync(document, page_nums)
+
+def cached_signature_pages(filepath, content_hash=None, keywords=None):
+    """The file's content hash and its cached signature pages (None on a miss)."""
+    use_keywords(keywords)
+    content_hash = content_hash or file_sha256(filepath)
+    return content_hash, detection_cache.get(detection_cache_key(content_hash))
+
+def plan_file(filepath, content_hash=None, keywords=None):
+    """
+    Run on a detection worker for a large upload: its content hash, cached signature pages (None on a miss)
+    and, on a miss, the pages detection has to scan, so the dispatcher can decide whether to shard it.
+    """
+    content_hash, signature_pages = cached_signature_pages(filepath, content_hash, keywords)
+    scope = []
+    if signature_pages is None:
+        with fitz.open(filepath) as doc:
+            scope = list(signature_detector.page_scope(doc.page_count))
+    return content_hash, signature_pages, scope
+
+def merge_shards(futures):
+    """Signature pages of a sharded document: the shards' pages in page order, limited like a whole-document scan."""
+    signature_pages = sorted(page_num for future in futures for page_num in future.result())
+    return signature_pages[:signature_detector.max_signatures or None]
+
+def process_files_in_pool(filepaths, content_hashes=None, keywords=None):
+    """
+    Run a batch on the detection workers. Uploads of at least SHARD_MIN_BYTES are planned on a worker, and those with
+    at least SHARD_MIN_PAGES pages to scan are split into SHARD_PAGES-page shards, so one large file doesn't keep
+    a single worker busy while the others sit idle. The shards of every large file in the batch are queued together.
+    """
+    content_hashes = content_hashes or [None] * len(filepaths)
+    results = [None] * len(filepaths)
+
+    def error_result(index, e):
+        logging.error(f"Error processing PDF file {filepaths[index]}: {e}")
+        results[index] = f'Error processing {os.path.basename(filepaths[index])}.', None, 0
 
-def process_file_sync(filepath):
-    return asyncio.run(process_file(filepath))
+    small_files, large_files = [], []
+    for index, filepath in enumerate(filepaths):
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            size = 0  # process_file_sync reports files it can't read
+        (large_files if size >= SHARD_MIN_BYTES else small_files).append(index)
+
+    # Small files go to one worker task; large files are planned on the other workers at the same time
+    small_future = None
+    if small_files:
+        small_future = process_executor.submit(process_files_sync, [filepaths[index] for index in small_files],
+                                               [content_hashes[index] for index in small_files], keywords)
+    plans = {index: process_executor.submit(plan_file, filepaths[index], content_hashes[index], keywords)
+             for index in large_files}
+
+    file_futures = {}
+    sharded = {}
+    for index, plan in plans.items():
+        try:
+            content_hash, signature_pages, scope = plan.result()
+        except Exception as e:
+            error_result(index, e)
+            continue
+        if signature_pages is None and len(scope) >= SHARD_MIN_PAGES:
+            logging.debug(f"Detecting {filepaths[index]} in {-(-len(scope) // SHARD_PAGES)} page shards")
+            sharded[index] = content_hash, [
+                process_executor.submit(detect_pages_sync, filepaths[index], scope[start:start + SHARD_PAGES], keywords)
+                for start in range(0, len(scope), SHARD_PAGES)]
+        else:
+            # A miss was already counted by the plan, so the worker goes straight to detection
+            file_futures[index] = process_executor.submit(process_file_sync, filepaths[index], content_hash,
+                                                          signature_pages, keywords, signature_pages is None)
+
+    for index, (content_hash, shard_futures) in sharded.items():
+        try:
+            signature_pages = merge_shards(shard_futures)
+        except Exception as e:
+            error_result(index, e)
+            continue
+        file_futures[index] = process_executor.submit(process_file_sync, filepaths[index], content_hash,
+                                                      signature_pages, keywords)
+
+    for index, future in file_futures.items():
+        results[index] = future.result()
+    if small_future is not None:
+        for index, result in zip(small_files, small_future.result()):
+            results[index] = result
+    return results
+
+# Pulls queued uploads and runs them on process_executor, independent of any HTTP request
+job_workers = JobWorkerPool(job_queue, process_files_in_pool, JOB_WORKERS, batch_size=FILES_PER_TASK)
+
+def enqueue_files(filepaths, cleanup=False, job_id=None, content_hashes=None, folder=None):
+    """Queue files with the keywords in effect now; folder, if given, is removed once the job is done."""
+    job_id = job_queue.create_job(filepaths, cleanup=cleanup, job_id=job_id, content_hashes=content_hashes,
+                                  keywords=current_keywords(), folder=folder)
+    job_workers.start()
+    job_workers.notify()
+    return job_id
 
 async def process_file(filepath):
+    return process_file_sync(filepath)
+
+def process_file_sync(filepath, content_hash=None, signature_pages=None, keywords=None, cache_missed=False):
+    """
+    Detect and extract the signature pages of a file; signature_pages skips detection when they are already known,
+    and cache_missed skips the detection cache lookup when the caller already missed it.
+    """
+    use_keywords(keywords)
     logging.debug(f"Processing file: {filepath}")
+    document = None
     try:
-        reader = PdfReader(filepath)
-        signature_pages = await signature_detector.detect_signature_pages(reader, filepath)
+        content_hash = content_hash or file_sha256(filepath)
+        cache_key = detection_cache_key(content_hash)
+        if signature_pages is not None:
+            # Detected in page shards, or read from the cache, by the caller
+            detection_cache.set(cache_key, signature_pages)
+        else:
+            if not cache_missed:
+                signature_pages = detection_cache.get(cache_key)
+            if signature_pages is None:
+                document = signature_detector.open_document(filepath)
+                signature_pages = signature_detector.detect_signature_pages_sync(document)
+                detection_cache.set(cache_key, signature_pages)
+            else:
+                logging.debug(f"Detection cache hit for {filepath}")
         num_signatures = len(signature_pages)
 
         if signature_pages:
             output_filename = f'{os.path.splitext(os.path.basename(filepath))[0]}_{num_signatures}_signatures.pdf'
             output_filepath = os.path.join(OUTPUT_FOLDER, output_filename)
-            await signature_detector.extract_signature_pages(reader, signature_pages, output_filepath)
+            # An existing output is reused only if it was extracted from this same upload; another file with the
+            # same name and signature count writes to the same output filename
+            if (document is not None or not os.path.exists(output_filepath)
+                    or output_index.source_hash(output_filename) != content_hash):
+                if document is None:
+                    document = signature_detector.open_document(filepath)
+                signature_detector.extract_signature_pages_sync(document, signature_pages, output_filepath)
+                # Recorded only when the output was written, so reusing one doesn't invalidate what's built from the index
+                output_index.record(output_filename, num_signatures, signature_pages, content_hash)
             return f'Processed {os.path.basename(filepath)}.<br>Total number of signatures: <span class="signature-count">{num_signatures}</span>', output_filename, num_signatures
         else:
             return f'Processed {os.path.basename(filepath)}:<br>No signature pages detected.', None, num_signatures
     except Exception as e:
         logging.error(f"Error processing PDF file {filepath}: {e}")
         return f'Error processing {os.path.basename(filepath)}.', None, 0
+    finally:
+        if document is not None:
+            document.close()
 
 async def cleanup_upload_folder():
     try:
@@ -84,26 +260,24 @@ async def upload_file():
 
     batch_size = app.config['BATCH_SIZE']
     total_files = len(files)
-    all_results = []
+    filepaths = []
+    content_hashes = []
+
+    # Each job gets its own folder so queued files can't be overwritten by a later upload with the same name
+    job_id = new_job_id()
+    job_folder = os.path.join(UPLOAD_FOLDER, f'job_{job_id}')
+    os.makedirs(job_folder, exist_ok=True)
 
     for i in range(0, total_files, batch_size):
         batch_files = files[i:i + batch_size]
-        filepaths = await asyncio.gather(*[save_file(file, UPLOAD_FOLDER) for file in batch_files])
-
-        # Process the files concurrently using ProcessPoolExecutor
-        loop = asyncio.get_event_loop()
-        results = await asyncio.gather(*[loop.run_in_executor(process_executor, process_file_sync, filepath) for filepath in filepaths])
-        all_results.extend(results)
-
-    messages = [result[0] for result in all_results]
-    download_links = [result[1] for result in all_results]
-    signatures_count = [result[2] for result in all_results]
+        for filepath, content_hash in await asyncio.gather(*[save_file(file, job_folder) for file in batch_files]):
+            filepaths.append(filepath)
+            content_hashes.append(content_hash)
 
-    # Clean up the upload folder after processing
-    logging.info("Starting cleanup of upload folder.")
-    await cleanup_upload_folder()
+    # Processing happens on the job workers; uploads are removed once each file is processed
+    enqueue_files(filepaths, cleanup=True, job_id=job_id, content_hashes=content_hashes, folder=job_folder)
 
-    return jsonify({'status': 'success', 'messages': messages, 'download_links': download_links, 'signatures_count': signatures_count})
+    return jsonify({'status': 'success', 'job_id': job_id, 'total_files': total_files}), 202
 
 @app.route('/clear_upload_dir', methods=['POST'])
 async def clear_upload_dir():
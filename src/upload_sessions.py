@@ -0,0 +1,197 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from config import UPLOAD_FOLDER, UPLOAD_SESSIONS_DB_PATH, MAX_CONTENT_LENGTH
+from src.chunks import write_chunk, finalize_chunks
+from src.sqlite_store import SQLiteStore
+
+
+class UploadSessionStore(SQLiteStore):
+    """
+    Chunked uploads grouped into sessions. Every session has its own folder under root_folder and a manifest
+    in SQLite of the chunks received per file, so chunks may arrive out of order, in parallel and through any
+    worker process that shares the filesystem, and a client can ask which chunks are missing after a disconnect.
+    No file may grow beyond max_file_size bytes.
+    """
+
+    isolation_level = None
+
+    def __init__(self, db_path, root_folder, max_file_size):
+        super().__init__(db_path)
+        self.root_folder = root_folder
+        self.max_file_size = max_file_size
+
+    def _create_schema(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_files (
+            session_id TEXT NOT NULL,
+            file_key TEXT NOT NULL,
+            total_chunks INTEGER NOT NULL,
+            total_size INTEGER,
+            complete INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, file_key)
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_chunks (
+            session_id TEXT NOT NULL,
+            file_key TEXT NOT NULL,
+            chunk_number INTEGER NOT NULL,
+            PRIMARY KEY (session_id, file_key, chunk_number)
+        )''')
+
+    def session_dir(self, session_id):
+        return os.path.join(self.root_folder, f'session_{session_id}')
+
+    def create(self, kind='upload'):
+        session_id = uuid.uuid4().hex
+        os.makedirs(self.session_dir(session_id), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO upload_sessions (id, kind, created_at) VALUES (?, ?, ?)', (session_id, kind, time.time()))
+        finally:
+            conn.close()
+        logging.info(f"Created {kind} upload session {session_id}")
+        return session_id
+
+    def exists(self, session_id):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT 1 FROM upload_sessions WHERE id = ?', (session_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def file_path(self, session_id, file_name, folder=None):
+        """Path of an uploaded file inside its session; only the base name of file_name is used."""
+        file_name = os.path.basename(file_name)
+        if file_name in ('', '.', '..'):
+            raise ValueError(f"Invalid file name: {file_name!r}")
+        directory = os.path.join(self.session_dir(session_id), folder) if folder else self.session_dir(session_id)
+        return os.path.join(directory, file_name)
+
+    def receive_chunk(self, session_id, stream, file_name, chunk_number, total_chunks, chunk_size, total_size=None,
+                      folder=None):
+        """
+        Write one chunk into the session and record it in the manifest.
+        Returns the file's final path once the file is complete, otherwise None.
+        Chunks that were already received are accepted again, so clients can simply retry.
+        """
+        final_path = self.file_path(session_id, file_name, folder)
+        file_key = os.path.relpath(final_path, self.session_dir(session_id))
+        if not 0 <= chunk_number < total_chunks:
+            raise ValueError(f"Chunk {chunk_number} is out of range for {total_chunks} chunks")
+        if chunk_size <= 0:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+        if total_size is not None:
+            if not 0 <= total_size <= self.max_file_size:
+                raise ValueError(f"File size {total_size} is over the {self.max_file_size} byte limit")
+            if total_chunks != max(-(-total_size // chunk_size), 1):
+                raise ValueError(f"{total_chunks} chunks of {chunk_size} bytes don't make a file of {total_size} bytes")
+        # Checked before anything is allocated or written; the chunk's own length is checked as it is copied
+        file_size = self.max_file_size if total_size is None else total_size
+        offset = chunk_number * chunk_size
+        if offset > file_size:
+            raise ValueError(f"Chunk {chunk_number} starts past the end of the file")
+
+        conn = self._connect()
+        try:
+            complete = conn.execute('SELECT complete FROM upload_files WHERE session_id = ? AND file_key = ?',
+                                    (session_id, file_key)).fetchone()
+            if complete and complete[0]:
+                return final_path
+
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            write_chunk(final_path, stream, offset, total_size, min(chunk_size, file_size - offset))
+
+            # Record the chunk only once it is on disk; the request that records the last missing chunk assembles the file
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR IGNORE INTO upload_files (session_id, file_key, total_chunks, total_size) VALUES (?, ?, ?, ?)',
+                         (session_id, file_key, total_chunks, total_size))
+            conn.execute('INSERT OR IGNORE INTO upload_chunks (session_id, file_key, chunk_number) VALUES (?, ?, ?)',
+                         (session_id, file_key, chunk_number))
+            received, = conn.execute('SELECT COUNT(*) FROM upload_chunks WHERE session_id = ? AND file_key = ?',
+                                     (session_id, file_key)).fetchone()
+            finalize = received >= total_chunks and conn.execute(
+                'UPDATE upload_files SET complete = 1 WHERE session_id = ? AND file_key = ? AND complete = 0',
+                (session_id, file_key)).rowcount == 1
+            conn.execute('COMMIT')
+
+            if not finalize:
+                return None
+            try:
+                return finalize_chunks(final_path, total_size)
+            except OSError:
+                conn.execute('UPDATE upload_files SET complete = 0 WHERE session_id = ? AND file_key = ?', (session_id, file_key))
+                raise
+        finally:
+            conn.close()
+
+    def save_file(self, session_id, file_storage, folder=None):
+        """Store a file uploaded in one piece (not chunked) in the session."""
+        final_path = self.file_path(session_id, file_storage.filename, folder)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        write_chunk(final_path, file_storage.stream, 0)
+        return finalize_chunks(final_path)
+
+    def manifest(self, session_id):
+        conn = self._connect()
+        try:
+            session = conn.execute('SELECT kind, created_at FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+            if session is None:
+                return None
+            files = conn.execute('SELECT file_key, total_chunks, total_size, complete FROM upload_files WHERE session_id = ?',
+                                 (session_id,)).fetchall()
+            chunks = conn.execute('SELECT file_key, chunk_number FROM upload_chunks WHERE session_id = ? ORDER BY chunk_number',
+                                  (session_id,)).fetchall()
+        finally:
+            conn.close()
+
+        received = {}
+        for file_key, chunk_number in chunks:
+            received.setdefault(file_key, []).append(chunk_number)
+
+        kind, created_at = session
+        return {
+            'session_id': session_id,
+            'kind': kind,
+            'created_at': created_at,
+            'files': {file_key: {
+                'total_chunks': total_chunks,
+                'total_size': total_size,
+                'complete': bool(complete),
+                'received_chunks': received.get(file_key, [])
+            } for file_key, total_chunks, total_size, complete in files}
+        }
+
+    def delete(self, session_id):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM upload_chunks WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM upload_files WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+
+    def expire(self, max_age):
+        """Delete sessions, and their files, that were created more than max_age seconds ago."""
+        conn = self._connect()
+        try:
+            expired = [row[0] for row in conn.execute('SELECT id FROM upload_sessions WHERE created_at < ?',
+                                                      (time.time() - max_age,)).fetchall()]
+        finally:
+            conn.close()
+        for session_id in expired:
+            self.delete(session_id)
+        if expired:
+            logging.info(f"Expired {len(expired)} upload sessions")
+
+
+upload_sessions = UploadSessionStore(UPLOAD_SESSIONS_DB_PATH, UPLOAD_FOLDER, MAX_CONTENT_LENGTH)
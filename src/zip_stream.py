@@ -0,0 +1,49 @@
+import os
+import zipfile
+
+# Output PDFs are already compressed, so storing them is nearly as small as deflating and much cheaper
+ZIP_COMPRESSION_MODES = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED
+}
+
+
+class _ChunkBuffer:
+    """Write-only file object that collects what ZipFile writes until the generator hands it to the response."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(file_paths, compression='stored', block_size=1024 * 1024):
+    """
+    Generate a ZIP archive of file_paths chunk by chunk, for a streamed response.
+    Entries are written while the files are read, so nothing is staged on disk and the first bytes go out immediately.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=ZIP_COMPRESSION_MODES[compression], allowZip64=True) as zipf:
+        for file_path in file_paths:
+            zinfo = zipfile.ZipInfo.from_file(file_path, os.path.basename(file_path))
+            zinfo.compress_type = zipf.compression
+            with open(file_path, 'rb') as source, zipf.open(zinfo, 'w', force_zip64=True) as entry:
+                for block in iter(lambda: source.read(block_size), b''):
+                    entry.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
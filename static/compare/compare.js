@@ -38,7 +38,18 @@ function updatePath(inputId, inputElement) {
     }
 }
 
-function uploadAndCompareFolders(folder1Files, folder2Files) {
+async function createUploadSession(kind) {
+    const response = await fetch('/upload_sessions', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ kind })
+    });
+    const data = await response.json();
+    return data.sessionId;
+}
+
+async function uploadAndCompareFolders(folder1Files, folder2Files) {
+    const sessionId = await createUploadSession('compare'); // Files of both folders are kept in this session
     const chunkSize = 1 * 1024 * 1024; // 1MB chunk size
     const batchSize = 100; // Number of files to upload in each batch
     let totalFiles = folder1Files.length + folder2Files.length;
@@ -64,9 +75,12 @@ function uploadAndCompareFolders(folder1Files, folder2Files) {
 
                     const formData = new FormData();
                     formData.append('chunk', chunk);
+                    formData.append('sessionId', sessionId);
                     formData.append('fileName', file.name);
                     formData.append('chunkNumber', currentChunk);
                     formData.append('totalChunks', totalChunks);
+                    formData.append('chunkSize', chunkSize);
+                    formData.append('totalSize', file.size);
                     formData.append('folder', folderName);
 
                     fetch('/upload_chunk', {
@@ -106,7 +120,7 @@ function uploadAndCompareFolders(folder1Files, folder2Files) {
                 } else if (filesUploaded === totalFiles) {
                     console.log('All files uploaded. Starting comparison.');
                     document.getElementById('progressBar').textContent = 'Upload completed. Comparing...'; // Update progress bar text
-                    fetchComparisonResults();
+                    fetchComparisonResults(sessionId);
                 }
             }
         }
@@ -124,13 +138,14 @@ function updateProgressBar(filesUploaded, totalFiles, maxPercent) {
     document.getElementById('progressBar').textContent = Math.floor(percentComplete) + '%';
 }
 
-function fetchComparisonResults() {
+function fetchComparisonResults(sessionId) {
     console.log('Fetching comparison results...');
     fetch('/compare_pdfs', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
-        }
+        },
+        body: JSON.stringify({ sessionId })
     })
     .then(response => {
         if (!response.ok) {
@@ -29,7 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (images.length > 0) {
             document.getElementById('original-image').src = images[index].original;
             document.getElementById('bounding-box-image').src = images[index].bounding_box;
-            const filename = images[index].original.split('/').pop();
+            const filename = images[index].name || images[index].original.split('/').pop();
             document.getElementById('message').textContent = `Current pdf: ${filename}`;
         }
     }
@@ -70,6 +70,7 @@ async function uploadFiles() {
     progressBarFill.innerText = '0%';
 
     let chunkSize =1 * 1024 * 1024;  // 5MB chunk size
+    let sessionId = await createUploadSession('upload');
     let allFilesProcessed = [];
     let totalChunksUploaded = 0;
     let totalChunks = Array.from(files).reduce((acc, file) => acc + Math.ceil(file.size / chunkSize), 0);
@@ -82,9 +83,12 @@ async function uploadFiles() {
             let chunk = file.slice(start, start + chunkSize);
             let formData = new FormData();
             formData.append('chunk', chunk);
+            formData.append('sessionId', sessionId);
             formData.append('fileName', file.name);
             formData.append('chunkNumber', chunkNumber);
             formData.append('totalChunks', fileChunks);
+            formData.append('chunkSize', chunkSize);
+            formData.append('totalSize', file.size);
 
             let response = await uploadFileChunk(formData);
             if (response.status === 'success' && response.message === 'File upload complete') {
@@ -109,13 +113,28 @@ async function uploadFiles() {
         }
     }
 
-    if (allFilesProcessed.length > 0) {
-        await processUploadedFiles(allFilesProcessed);
+    try {
+        if (allFilesProcessed.length > 0) {
+            await processUploadedFiles(allFilesProcessed);
+        }
+    } finally {
+        // The uploaded files are no longer needed once they are processed
+        await deleteUploadSession(sessionId);
     }
 
     uploadBtn.disabled = false;
 }
 
+async function createUploadSession(kind) {
+    let response = await fetch('/upload_sessions', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ kind })
+    });
+    let data = await response.json();
+    return data.sessionId;
+}
+
 function uploadFileChunk(formData) {
     return new Promise((resolve, reject) => {
         let xhr = new XMLHttpRequest();
@@ -188,9 +207,6 @@ async function processUploadedFiles(filePaths) {
 
     displayFiles(currentPage);
     updatePagination();
-
-    // Clear the upload folder once processing is complete
-    await clearUploadFolder();
 }
 
 function processFile(filePath) {
@@ -278,23 +294,9 @@ clearUploadDirBtn.addEventListener('click', () => {
     xhr.send();
 });
 
-async function clearUploadFolder() {
-    return new Promise((resolve, reject) => {
-        let xhr = new XMLHttpRequest();
-        xhr.open('POST', '/clear_upload_dir');
-        xhr.onload = () => {
-            if (xhr.status === 200) {
-                let response = JSON.parse(xhr.response);
-                if (response.status === 'success') {
-                    resolve(response);
-                } else {
-                    reject(response.message);
-                }
-            } else {
-                reject(xhr.statusText);
-            }
-        };
-        xhr.onerror = () => reject(xhr.statusText);
-        xhr.send();
-    });
+async function deleteUploadSession(sessionId) {
+    let response = await fetch(`/upload_sessions/${sessionId}`, { method: 'DELETE' });
+    if (!response.ok) {
+        console.error(`Error deleting upload session ${sessionId}: ${response.statusText}`);
+    }
 }
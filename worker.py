@@ -0,0 +1,26 @@
+import logging
+import os
+import time
+
+from flask_socketio import SocketIO
+
+from src.upload import job_workers
+
+# Runs job workers without the web tier; optional, since every web process starts its own pool as well.
+# Progress reaches browsers through the Socket.IO message queue the web processes are attached to
+# (e.g. redis://), when one is configured.
+message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+if message_queue:
+    socketio = SocketIO(message_queue=message_queue)
+
+    def job_progress(job_id, processed, total):
+        progress = round(processed / total * 100) if total else 100
+        socketio.emit('progress_update', {'progress': progress, 'message': f'{processed} of {total} files processed', 'job_id': job_id})
+
+    job_workers.on_progress = job_progress
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    job_workers.start()
+    while True:
+        time.sleep(60)